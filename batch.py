@@ -0,0 +1,274 @@
+"""
+Random playouts on many boards at once with NumPy. The boards are a (K, 64) array of piece codes
+(chess.PIECE_CODES, square = row * 8 + column) and every step plays one uniformly random legal
+move on every board still running, with the same rules as BoardHumanVHuman.
+
+Moves are picked from a fixed table of every (from, to) square pair a piece could ever use.
+Pseudo-legal moves are found for all boards and pairs with array operations, then one is drawn
+per board and checked for leaving the own king attacked. Illegal draws are struck out and
+drawn again, which keeps the pick uniform over the legal moves.
+
+Example:
+    python batch.py --boards 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+import chess
+
+RUNNING, CHECKMATE, STALEMATE, MAX_TURN = 0, 1, 2, 3
+STATUS_NAMES = {RUNNING: None, CHECKMATE: "checkmate", STALEMATE: "stalemate", MAX_TURN: "max_turn"}
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+# Colour and kind of every piece code, -1 for an empty square
+COLOR_OF = np.array([-1] + [chess.WHITE] * 6 + [chess.BLACK] * 6, dtype=np.int8)
+KIND_OF = np.array([-1] + list(range(6)) * 2, dtype=np.int8)
+VALUE_OF = np.array([piece[1] if piece != chess.NONE_PIECE else 0 for piece in chess.PIECE_CODES], dtype=np.int32)
+PAWN_CODE = (chess.PIECE_CODE_OF[chess.WHITE_PAWN], chess.PIECE_CODE_OF[chess.BLACK_PAWN])
+QUEEN_CODE = (chess.PIECE_CODE_OF[chess.WHITE_QUEEN], chess.PIECE_CODE_OF[chess.BLACK_QUEEN])
+KING_CODE = (chess.PIECE_CODE_OF[chess.WHITE_KING], chess.PIECE_CODE_OF[chess.BLACK_KING])
+LAST_ROW = (7, 0)
+
+
+def _pair_tables():
+    """Every (from, to) pair on a line, diagonal or knight jump, and what each piece may do with it"""
+    pairs = []
+    for start in range(64):
+        for end in range(64):
+            row_step, column_step = end // 8 - start // 8, end % 8 - start % 8
+            line = row_step == 0 or column_step == 0
+            diagonal = abs(row_step) == abs(column_step)
+            knight = {abs(row_step), abs(column_step)} == {1, 2}
+            if start != end and (line or diagonal or knight):
+                pairs.append((start, end, row_step, column_step, line, diagonal, knight))
+
+    count = len(pairs)
+    starts = np.array([pair[0] for pair in pairs], dtype=np.int64)
+    ends = np.array([pair[1] for pair in pairs], dtype=np.int64)
+    # allowed[code, pair]: the piece moves and attacks this way (pawns are handled separately)
+    allowed = np.zeros((13, count), dtype=bool)
+    pawn_push = np.zeros((2, count), dtype=bool)
+    pawn_double = np.zeros((2, count), dtype=bool)
+    pawn_capture = np.zeros((2, count), dtype=bool)
+    # between[pair, square]: squares strictly between start and end that must be empty
+    between = np.zeros((count, 64), dtype=bool)
+    for index, (start, end, row_step, column_step, line, diagonal, knight) in enumerate(pairs):
+        geometry = {KNIGHT: knight, BISHOP: diagonal and not line, ROOK: line,
+                    QUEEN: line or diagonal, KING: max(abs(row_step), abs(column_step)) == 1}
+        for code in range(1, 13):
+            if KIND_OF[code] != PAWN:
+                allowed[code, index] = geometry[KIND_OF[code]]
+        for color, forward, start_row in ((chess.WHITE, 1, 1), (chess.BLACK, -1, 6)):
+            pawn_push[color, index] = row_step == forward and column_step == 0
+            pawn_double[color, index] = row_step == 2 * forward and column_step == 0 and start // 8 == start_row
+            pawn_capture[color, index] = row_step == forward and abs(column_step) == 1
+        if not knight:
+            distance = max(abs(row_step), abs(column_step))
+            row_unit, column_unit = np.sign(row_step), np.sign(column_step)
+            for step in range(1, distance):
+                between[index, start + step * (8 * row_unit + column_unit)] = True
+
+    # allowed as bit masks, bit code of allowed_bits[pair] is allowed[code, pair], so a whole array
+    # of piece codes can be tested with one shift
+    allowed_bits = (allowed.astype(np.int16) << np.arange(13, dtype=np.int16)[:, None]).sum(0).astype(np.int16)
+    # pawn_capture_bits[pair] has bit colour set when a pawn of that colour captures along pair
+    pawn_capture_bits = (pawn_capture.astype(np.int16) << np.arange(2, dtype=np.int16)[:, None]).sum(0).astype(np.int16)
+
+    # pairs_to[square] lists the pairs ending on square, padded with -1, for attack tests
+    ending = [np.flatnonzero(ends == square) for square in range(64)]
+    width = max(len(indexes) for indexes in ending)
+    pairs_to = np.full((64, width), -1, dtype=np.int64)
+    for square, indexes in enumerate(ending):
+        pairs_to[square, :len(indexes)] = indexes
+    return starts, ends, allowed_bits, pawn_push | pawn_double, pawn_capture, pawn_capture_bits, between, pairs_to
+
+
+(STARTS, ENDS, ALLOWED_BITS, PAWN_ADVANCE, PAWN_CAPTURE, PAWN_CAPTURE_BITS,
+ BETWEEN, PAIRS_TO) = _pair_tables()
+PAIR_COUNT = len(STARTS)
+BETWEEN_T = BETWEEN.T.astype(np.float32)
+
+
+def pseudo_legal(squares, turn):
+    """(K, pairs) mask of the moves that follow the piece rules, ignoring checks"""
+    pieces = squares[:, STARTS]
+    targets = squares[:, ENDS]
+    # Codes of the side to move are first to first + 5, its pawn being first
+    first = (1 + 6 * turn)[:, None].astype(np.int8)
+    own_piece = (pieces >= first) & (pieces < first + 6)
+    target_empty = targets == 0
+    target_own = (targets >= first) & (targets < first + 6)
+    # A pair is blocked when any square between its ends is occupied
+    occupied = (squares != 0).astype(np.float32)
+    clear = (occupied @ BETWEEN_T) == 0
+
+    pawn_moves = (target_empty & PAWN_ADVANCE[turn]) | (~target_empty & ~target_own & PAWN_CAPTURE[turn])
+    # Pawn codes have no allowed bits, so this part is only ever true for the other pieces
+    other_moves = ((ALLOWED_BITS >> pieces) & 1).astype(bool) & ~target_own
+    return own_piece & clear & (other_moves | ((pieces == first) & pawn_moves))
+
+
+def king_attacked(squares, color):
+    """Per board, whether the king of color (0/1 per board) is attacked by the other side"""
+    count = len(squares)
+    if count == 0:
+        return np.zeros(0, dtype=bool)
+    king_codes = np.asarray(KING_CODE, dtype=np.int8)[color]
+    is_king = squares == king_codes[:, None]
+    has_king = is_king.any(1)
+    king_square = is_king.argmax(1)
+
+    pairs = PAIRS_TO[king_square]
+    valid = pairs >= 0
+    pairs = np.where(valid, pairs, 0)
+    pieces = squares[np.arange(count)[:, None], STARTS[pairs]]
+    attacker = (1 - color)[:, None]
+    first = (1 + 6 * attacker).astype(np.int8)
+    attacking_piece = (pieces >= first) & (pieces < first + 6)
+    # The enemy king counts too, which covers the rule that kings may not stand next to each other
+    geometry = (((ALLOWED_BITS[pairs] >> pieces) & 1).astype(bool)
+                | ((pieces == first) & ((PAWN_CAPTURE_BITS[pairs] >> attacker) & 1).astype(bool)))
+    occupied = squares != 0
+    clear = ~(BETWEEN[pairs] & occupied[:, None, :]).any(2)
+    return has_king & (valid & attacking_piece & geometry & clear).any(1)
+
+
+def apply_moves(squares, pairs) -> None:
+    """Plays pair index pairs[k] on board k in place, pawns reaching the last row become queens"""
+    rows = np.arange(len(squares))
+    starts, ends = STARTS[pairs], ENDS[pairs]
+    pieces = squares[rows, starts]
+    color = COLOR_OF[pieces]
+    promoted = (pieces == np.asarray(PAWN_CODE)[color]) & (ends // 8 == np.asarray(LAST_ROW)[color])
+    squares[rows, starts] = 0
+    squares[rows, ends] = np.where(promoted, np.asarray(QUEEN_CODE)[color], pieces)
+
+
+class BatchPlayout():
+    def __init__(self, positions, max_turn: int = 300, seed=None):
+        """
+        positions is a list of to_compact() strings (or Position objects), one per board.
+        Boards play uniformly random legal moves until checkmate, stalemate or max_turn.
+        """
+        compacts = [position.to_compact() if isinstance(position, chess.Position) else position
+                    for position in positions]
+        data = np.frombuffer(b"".join(compacts), dtype=np.uint8).reshape(len(compacts), 67)
+        self.squares = data[:, :64].astype(np.int8)
+        self.turn = data[:, 64].astype(np.int64)
+        self.current_turn = data[:, 65].astype(np.int64) | (data[:, 66].astype(np.int64) << 8)
+        self.status = np.full(len(compacts), RUNNING, dtype=np.int8)
+        self.max_turn = max_turn
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_start(cls, count: int, max_turn: int = 300, seed=None):
+        """count boards in the starting position"""
+        return cls([chess.BoardHumanVHuman().to_compact()] * count, max_turn, seed)
+
+    def __len__(self) -> int:
+        return len(self.squares)
+
+    def sample_legal(self, squares, turn):
+        """A uniformly random legal pair index per board, -1 where there is no legal move"""
+        candidates = pseudo_legal(squares, turn)
+        chosen = np.full(len(squares), -1, dtype=np.int64)
+        pending = np.flatnonzero(candidates.any(1))
+        while len(pending):
+            # The candidate with the highest random key is a uniform pick among the candidates
+            keys = self.rng.random((len(pending), PAIR_COUNT), dtype=np.float32)
+            picks = np.where(candidates[pending], keys, -1).argmax(1)
+            after = squares[pending].copy()
+            apply_moves(after, picks)
+            illegal = king_attacked(after, turn[pending])
+            chosen[pending[~illegal]] = picks[~illegal]
+            # Struck out and drawn again from what is left
+            candidates[pending[illegal], picks[illegal]] = False
+            pending = pending[illegal]
+            pending = pending[candidates[pending].any(1)]
+        return chosen
+
+    def step(self, play: bool = True) -> int:
+        """
+        Works out the status of every running board and, with play, plays one random legal move on
+        the boards that go on. Returns how many boards are still running.
+        """
+        running = np.flatnonzero(self.status == RUNNING)
+        if len(running) == 0:
+            return 0
+        squares = self.squares[running]
+        turn = self.turn[running]
+        chosen = self.sample_legal(squares, turn)
+
+        stuck = chosen < 0
+        in_check = king_attacked(squares[stuck], turn[stuck])
+        self.status[running[stuck]] = np.where(in_check, CHECKMATE, STALEMATE)
+        over = ~stuck & (self.current_turn[running] >= self.max_turn)
+        self.status[running[over]] = MAX_TURN
+
+        if play:
+            moving = ~stuck & ~over
+            boards = running[moving]
+            after = squares[moving]
+            apply_moves(after, chosen[moving])
+            self.squares[boards] = after
+            self.turn[boards] ^= 1
+            self.current_turn[boards] += 1
+        return int((self.status == RUNNING).sum())
+
+    def run(self, plies=None) -> dict:
+        """Plays until every board is finished, or for plies moves, then counts the statuses"""
+        done = 0
+        while (plies is None or done < plies) and self.step():
+            done += 1
+        if plies is not None:
+            # Boards stopped by the ply limit may still have been mated by their last move
+            self.step(play=False)
+        return self.counts()
+
+    def counts(self) -> dict:
+        return {STATUS_NAMES[status] or "running": int((self.status == status).sum())
+                for status in STATUS_NAMES}
+
+    def results_for_white(self):
+        """AIVMCTS.result_for_white per board: 1/0/0.5 for finished games, material for unfinished ones"""
+        values = VALUE_OF[self.squares]
+        pieces_color = COLOR_OF[self.squares]
+        white = (values * (pieces_color == chess.WHITE)).sum(1)
+        black = (values * (pieces_color == chess.BLACK)).sum(1)
+        results = 0.5 + 0.5 * (white - black) / np.maximum(white + black, 1)
+        results = np.where(self.status == CHECKMATE, np.where(self.turn == chess.WHITE, 0.0, 1.0), results)
+        return np.where((self.status == STALEMATE) | (self.status == MAX_TURN), 0.5, results)
+
+    def position(self, index: int):
+        """Board index as a chess.Position"""
+        return chess.Position(self.squares[index].astype(np.uint8).tobytes(), int(self.turn[index]),
+                              int(self.current_turn[index]))
+
+
+def rollout_results(compacts: list, plies: int, seed=None, max_turn: int = 300) -> list:
+    """Random playouts of plies moves from every to_compact() position, scored like AIVMCTS.rollout"""
+    playout = BatchPlayout(compacts, max_turn=max_turn, seed=seed)
+    playout.run(plies)
+    return playout.results_for_white().tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Random games on many boards at once")
+    parser.add_argument("--boards", type=int, default=1000)
+    parser.add_argument("--plies", type=int, default=None, help="Stop after this many moves instead of game end")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    playout = BatchPlayout.from_start(args.boards, seed=args.seed)
+    start = time.perf_counter()
+    counts = playout.run(args.plies)
+    elapsed = time.perf_counter() - start
+    plies = int(playout.current_turn.sum())
+    print(f"{args.boards} boards, {plies} plies in {elapsed:.1f}s ({plies / elapsed:.0f} plies/s)")
+    print(", ".join(f"{name} {count}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
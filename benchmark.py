@@ -0,0 +1,169 @@
+"""
+Micro-benchmarks for the board hot paths on fixed opening, middlegame and endgame positions.
+
+Every benchmark is seeded and timed in several rounds of a minimum length. The fastest round is
+what gets compared, since noise only ever makes a round slower, and a slowdown only counts as a
+regression when it is also bigger than the spread between the rounds. Caches are cleared before each
+call (outside the timing), so the numbers are for working a position out from scratch.
+
+Example:
+    python benchmark.py --output baseline.json
+    python benchmark.py --output current.json --compare baseline.json --threshold 0.10
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import chess
+
+POSITIONS = {
+    "opening": "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b - - 0 1",
+    "middlegame": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1",
+    "endgame": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+}
+
+# Settings of the AIVMCTS used by the get_score and MCTS benchmarks
+MCTS_SETTINGS = {"depth": 2, "width": 24, "tt_mb": 4, "seed": 1}
+
+# Every benchmark runs ROUNDS rounds of at least ROUND_SECONDS (times --scale) of timed calls
+ROUNDS = 5
+ROUND_SECONDS = 0.05
+
+
+def time_calls(function, round_seconds: float, setup=None) -> dict:
+    """
+    Runs setup (untimed) and function until round_seconds of calls are timed, ROUNDS times.
+    Returns the per-call time of the fastest and the median round in microseconds, and the spread,
+    how much slower the slowest round was than the fastest as a fraction.
+    """
+    rounds = []
+    calls = 0
+    for _ in range(ROUNDS):
+        elapsed = 0.0
+        count = 0
+        while elapsed < round_seconds:
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            elapsed += time.perf_counter() - start
+            count += 1
+        rounds.append(elapsed / count)
+        calls += count
+    rounds.sort()
+    return {"calls": calls, "best_us": 1e6 * rounds[0], "median_us": 1e6 * rounds[ROUNDS // 2],
+            "spread": rounds[-1] / rounds[0] - 1}
+
+
+def position_benchmarks(fen: str, scale: float) -> dict:
+    board = chess.BoardHumanVHuman()
+    board.from_fen(fen)
+    moves = board.action_space()
+    # A spread of legal and illegal (row, column, row, column) pairs from the own pieces
+    candidates = [(row, column, next_row, next_column)
+                  for row, column in sorted(board.piece_squares[board.white if board.turn == "white" else board.black])
+                  for next_row, next_column in board.candidate_targets(row, column)]
+
+    round_seconds = ROUND_SECONDS * scale
+
+    def check():
+        if board.turn == "white":
+            board.is_white_check()
+        else:
+            board.is_black_check()
+
+    def move_valid():
+        for move in candidates:
+            board.is_move_valid(*move)
+
+    def move_and_take_back():
+        board.move_api(*moves[0])
+        board.unmake_move()
+
+    results = {
+        "action_space": time_calls(board.action_space, round_seconds, board.clear_caches),
+        "is_move_valid": time_calls(move_valid, round_seconds, board.clear_caches),
+        "is_check": time_calls(check, round_seconds, board.clear_caches),
+        "is_checkmate": time_calls(board.is_checkmate, round_seconds, board.clear_caches),
+        "random_action": time_calls(board.random_action, round_seconds, board.clear_caches),
+        "move_api": time_calls(move_and_take_back, round_seconds, board.clear_caches),
+    }
+    results["is_move_valid"]["candidates"] = len(candidates)
+
+    engines = []
+
+    def new_engine():
+        engine = chess.AIVMCTS(**MCTS_SETTINGS)
+        engine.from_fen(fen)
+        engines.append(engine)
+
+    new_engine()
+    results["get_score"] = time_calls(engines[-1].get_score, round_seconds)
+    results["MCTS"] = time_calls(lambda: engines[-1].MCTS(), round_seconds, new_engine)
+    return results
+
+
+def run(seed: int = 0, scale: float = 1.0) -> dict:
+    results = {}
+    for name, fen in POSITIONS.items():
+        random.seed(seed)
+        for benchmark, timing in position_benchmarks(fen, scale).items():
+            results[f"{name}/{benchmark}"] = timing
+    return {"meta": {"python": sys.version.split()[0], "platform": platform.platform(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": seed, "scale": scale},
+            "results": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Names of benchmarks whose fastest round got slower than the baseline's by more than threshold
+    and by more than the spread between the rounds of either run
+    """
+    regressions = []
+    for name, timing in current["results"].items():
+        old = baseline["results"].get(name)
+        # Baselines written before the rounds were added have no best_us to compare with
+        if old is None or "best_us" not in old:
+            print(f"{name:30} {timing['best_us']:12.1f} us   (new)")
+            continue
+        change = timing["best_us"] / old["best_us"] - 1
+        noise = max(timing["spread"], old["spread"])
+        flag = ""
+        if change > max(threshold, noise):
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:30} {timing['best_us']:12.1f} us   {old['best_us']:12.1f} us   "
+              f"{100 * change:+7.1f}% (noise {100 * noise:.0f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Board hot path micro-benchmarks")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the results as JSON")
+    parser.add_argument("--compare", default=None, help="Baseline JSON written by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown that counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplies the number of calls")
+    args = parser.parse_args()
+
+    current = run(args.seed, args.scale)
+    with open(args.output, "w") as file:
+        json.dump(current, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {100 * args.threshold:.0f}%")
+            sys.exit(1)
+    else:
+        for name, timing in current["results"].items():
+            print(f"{name:30} {timing['best_us']:12.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+import json
+
+import chess
+from evaluation import SQUARE_SCORES
+
+# Square index is row * 8 + column, so bit 0 is a1 (row 0, column 0) and bit 63 is h8
+FULL_BOARD = (1 << 64) - 1
+
+# Ray directions as (row step, column step). The first four walk towards higher square indexes.
+NORTH, EAST, NORTH_EAST, NORTH_WEST, SOUTH, WEST, SOUTH_EAST, SOUTH_WEST = range(8)
+RAY_STEPS = ((1, 0), (0, 1), (1, 1), (1, -1), (-1, 0), (0, -1), (-1, 1), (-1, -1))
+LINE_RAYS = (NORTH, EAST, SOUTH, WEST)
+DIAGONAL_RAYS = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+
+
+def _offsets_table(offsets):
+    table = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        mask = 0
+        for dr, dc in offsets:
+            r, c = row + dr, column + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                mask |= 1 << (r * 8 + c)
+        table.append(mask)
+    return table
+
+
+def _ray_table(step):
+    table = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        mask = 0
+        r, c = row + step[0], column + step[1]
+        while 0 <= r < 8 and 0 <= c < 8:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + step[0], c + step[1]
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _offsets_table(chess.KNIGHT_OFFSETS)
+KING_ATTACKS = _offsets_table(chess.KING_OFFSETS)
+# PAWN_ATTACKS[color][square] are the squares a pawn of that colour on square attacks
+PAWN_ATTACKS = (_offsets_table(((1, -1), (1, 1))), _offsets_table(((-1, -1), (-1, 1))))
+RAYS = tuple(_ray_table(step) for step in RAY_STEPS)
+
+
+def _between_table():
+    # BETWEEN[a][b] are the squares strictly between a and b on a shared line or diagonal, else 0
+    table = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        for direction in range(8):
+            ray = RAYS[direction][square]
+            for target in squares_of(ray):
+                table[square][target] = ray & ~RAYS[direction][target] & ~(1 << target)
+    return table
+
+
+def ray_attacks(square: int, occupied: int, directions) -> int:
+    """Squares a slider on square attacks along directions, up to and including the first blocker"""
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= RAYS[direction][first_blocker(direction, blockers)]
+        attacks |= ray
+    return attacks
+
+
+def squares_of(bitboard: int):
+    """Yields the set squares of a bitboard from lowest to highest"""
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+def first_blocker(direction: int, blockers: int) -> int:
+    """Square of the blocker nearest to the start of a ray in direction"""
+    if direction < SOUTH:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
+BETWEEN = _between_table()
+
+
+class BitBoardHumanVHuman(chess.BoardHumanVHuman):
+    """
+    Same game and public API as BoardHumanVHuman, but the position is kept as one 64-bit integer
+    per piece type and colour. game_board is rebuilt from the bitboards when it is read, so code that
+    renders or inspects the board keeps working unchanged.
+    """
+
+    def make_board(self):
+        # Piece tuples in bitboard order, index 0-5 is white and 6-11 is black
+        self.piece_order = [self.white_pawn, self.white_knight, self.white_bishop,
+                            self.white_rook, self.white_queen, self.white_king,
+                            self.black_pawn, self.black_knight, self.black_bishop,
+                            self.black_rook, self.black_queen, self.black_king]
+        self.piece_index = {piece: index for index, piece in enumerate(self.piece_order)}
+        self.zobrist_pieces = [chess.ZOBRIST_PIECES[(piece[0], piece[2])] for piece in self.piece_order]
+        self.square_scores = [SQUARE_SCORES[(piece[0], piece[2])] for piece in self.piece_order]
+        self.undo_stack = []
+
+        board = [[self.none_piece for j in range(8)] for i in range(8)]
+        back_rank = [3, 1, 2, 4, 5, 2, 1, 3]
+        for column, index in enumerate(back_rank):
+            board[0][column] = self.piece_order[index]
+            board[7][column] = self.piece_order[index + 6]
+            board[1][column] = self.white_pawn
+            board[6][column] = self.black_pawn
+        self.load_board(board)
+        return board
+
+    def load_board(self, board) -> None:
+        """Fills the bitboards from an 8x8 list of piece tuples"""
+        self.bitboards = [0] * 12
+        # Mailbox of piece indexes (-1 when empty) so captures can be found without a scan
+        self.squares = [-1] * 64
+        for row in range(8):
+            for column in range(8):
+                piece = tuple(board[row][column])
+                if piece in self.piece_index:
+                    index = self.piece_index[piece]
+                    self.bitboards[index] |= 1 << (row * 8 + column)
+                    self.squares[row * 8 + column] = index
+        self.occupancy = [0, 0]
+        for index in range(12):
+            self.occupancy[index // 6] |= self.bitboards[index]
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material_totals, self.square_score_totals = self.compute_evaluation_totals()
+        self.clear_caches()
+
+    def compute_evaluation_totals(self) -> tuple:
+        material = [0, 0]
+        square_scores = [0, 0]
+        for square, index in enumerate(self.squares):
+            if index >= 0:
+                material[index // 6] += self.piece_order[index][1]
+                square_scores[index // 6] += self.square_scores[index][square]
+        return material, square_scores
+
+    @property
+    def piece_squares(self):
+        # Rebuilt from the occupancy like game_board, for the inherited code that reads it
+        return [{divmod(square, 8) for square in squares_of(self.occupancy[color])} for color in (0, 1)]
+
+    @property
+    def king_squares(self):
+        kings = []
+        for color in (0, 1):
+            king = self.bitboards[6 * color + 5]
+            kings.append(divmod(king.bit_length() - 1, 8) if king else None)
+        return kings
+
+    @property
+    def game_board(self):
+        board = [[self.none_piece for j in range(8)] for i in range(8)]
+        for square, index in enumerate(self.squares):
+            if index >= 0:
+                board[square // 8][square % 8] = self.piece_order[index]
+        return board
+
+    @game_board.setter
+    def game_board(self, board):
+        # make_board is still running when the base class assigns its result
+        if board is not None and hasattr(self, "piece_index"):
+            self.load_board(board)
+
+    def blank_board(self):
+        self.load_board([[self.none_piece for j in range(8)] for i in range(8)])
+        self.undo_stack = []
+
+    def set_board(self, dict):
+        self.load_board(dict["game_board"])
+        self.undo_stack = []
+
+    def make_board_from_json(self, json_data):
+        self.load_board(json.loads(json_data))
+        self.undo_stack = []
+
+    def is_square_attacked(self, square: int, by_color: int, include_king: bool = True, occupied=None) -> bool:
+        """occupied replaces the real occupancy for the sliders, e.g. without a king that steps away"""
+        offset = 6 * by_color
+        bitboards = self.bitboards
+        if PAWN_ATTACKS[1 - by_color][square] & bitboards[offset]:
+            return True
+        if KNIGHT_ATTACKS[square] & bitboards[offset + 1]:
+            return True
+        if include_king and KING_ATTACKS[square] & bitboards[offset + 5]:
+            return True
+        if occupied is None:
+            occupied = self.occupancy[0] | self.occupancy[1]
+        diagonal_sliders = bitboards[offset + 2] | bitboards[offset + 4]
+        if diagonal_sliders and ray_attacks(square, occupied, DIAGONAL_RAYS) & diagonal_sliders:
+            return True
+        line_sliders = bitboards[offset + 3] | bitboards[offset + 4]
+        if line_sliders and ray_attacks(square, occupied, LINE_RAYS) & line_sliders:
+            return True
+        return False
+
+    def is_in_check(self, color: int, include_king: bool = False) -> bool:
+        # Like the tuple board, the enemy king only matters for king moves (is_kings_in_proximity)
+        king = self.bitboards[6 * color + 5]
+        if not king:
+            return False
+        return self.is_square_attacked(king.bit_length() - 1, 1 - color, include_king)
+
+    def is_white_check(self) -> bool:
+        return self.is_in_check(self.white)
+
+    def is_black_check(self) -> bool:
+        return self.is_in_check(self.black)
+
+    def is_king_attacked(self, color: int) -> bool:
+        return self.is_in_check(color)
+
+    def pseudo_targets(self, square: int) -> int:
+        """Bitboard of the squares the piece on square can move to, ignoring checks"""
+        index = self.squares[square]
+        color = index // 6
+        kind = index % 6
+        own = self.occupancy[color]
+        enemy = self.occupancy[1 - color]
+        occupied = own | enemy
+
+        if kind == 0:
+            step = 8 if color == self.white else -8
+            start_row = 1 if color == self.white else 6
+            targets = PAWN_ATTACKS[color][square] & enemy
+            one_step = square + step
+            if 0 <= one_step < 64 and not (occupied >> one_step) & 1:
+                targets |= 1 << one_step
+                two_step = one_step + step
+                if square // 8 == start_row and not (occupied >> two_step) & 1:
+                    targets |= 1 << two_step
+            return targets
+        if kind == 1:
+            return KNIGHT_ATTACKS[square] & ~own
+        if kind == 5:
+            return KING_ATTACKS[square] & ~own
+        directions = ()
+        if kind in (2, 4):
+            directions += DIAGONAL_RAYS
+        if kind in (3, 4):
+            directions += LINE_RAYS
+        return ray_attacks(square, occupied, directions) & ~own & FULL_BOARD
+
+    def analyze_position(self) -> dict:
+        """
+        Bitboard version of BoardHumanVHuman.analyze_position, cached until a move is played:
+        the enemy pieces giving check, the squares a non-king move must land on to answer it
+        and the pinned pieces with the ray they can still move along.
+        """
+        if self.position_info is not None:
+            return self.position_info
+
+        color = self.white if self.turn == "white" else self.black
+        offset = 6 * (1 - color)
+        bitboards = self.bitboards
+        occupied = self.occupancy[0] | self.occupancy[1]
+        king = bitboards[6 * color + 5]
+        checkers = 0
+        evasions = FULL_BOARD
+        pins = {}
+        if king:
+            square = king.bit_length() - 1
+            diagonal_sliders = bitboards[offset + 2] | bitboards[offset + 4]
+            line_sliders = bitboards[offset + 3] | bitboards[offset + 4]
+            # The enemy king gives no check here, like in is_in_check
+            checkers = ((PAWN_ATTACKS[color][square] & bitboards[offset])
+                        | (KNIGHT_ATTACKS[square] & bitboards[offset + 1])
+                        | (ray_attacks(square, occupied, DIAGONAL_RAYS) & diagonal_sliders)
+                        | (ray_attacks(square, occupied, LINE_RAYS) & line_sliders))
+            if checkers:
+                if checkers & (checkers - 1):
+                    # Only the king can answer a double check
+                    evasions = 0
+                else:
+                    checker = checkers.bit_length() - 1
+                    evasions = checkers | BETWEEN[square][checker]
+
+            # Pins, the first own piece on a ray from the king with an enemy slider right behind it
+            for directions, sliders in ((LINE_RAYS, line_sliders), (DIAGONAL_RAYS, diagonal_sliders)):
+                for direction in directions:
+                    ray = RAYS[direction][square]
+                    if not ray & sliders:
+                        continue
+                    blockers = ray & occupied
+                    pinned = first_blocker(direction, blockers)
+                    if not (self.occupancy[color] >> pinned) & 1:
+                        continue
+                    behind = RAYS[direction][pinned] & occupied
+                    if not behind:
+                        continue
+                    pinner = first_blocker(direction, behind)
+                    if (sliders >> pinner) & 1:
+                        pins[pinned] = BETWEEN[square][pinner] | (1 << pinner)
+
+        self.position_info = {"checkers": checkers, "evasions": evasions, "pins": pins}
+        return self.position_info
+
+    def legal_target_mask(self, square: int) -> int:
+        """Bitboard of the legal targets of the piece on square, from analyze_position"""
+        index = self.squares[square]
+        targets = self.pseudo_targets(square)
+        if index % 6 == 5:
+            # The king leaves its square, so sliders see through it to the squares behind
+            occupied = (self.occupancy[0] | self.occupancy[1]) ^ (1 << square)
+            enemy = 1 - index // 6
+            for target in squares_of(targets):
+                if self.is_square_attacked(target, enemy, True, occupied):
+                    targets ^= 1 << target
+            return targets
+        info = self.analyze_position()
+        return targets & info["evasions"] & info["pins"].get(square, FULL_BOARD)
+
+    def legal_targets(self, square: int) -> list:
+        return list(squares_of(self.legal_target_mask(square)))
+
+    def scan_legal_moves(self):
+        color = self.white if self.turn == "white" else self.black
+        for square in squares_of(self.occupancy[color]):
+            row, column = divmod(square, 8)
+            for target in squares_of(self.legal_target_mask(square)):
+                yield (row, column, target // 8, target % 8)
+
+    def is_move_valid(self, current_row: int, current_column: int, next_row: int, next_column: int) -> bool:
+        square = current_row * 8 + current_column
+        target = next_row * 8 + next_column
+        index = self.squares[square]
+        color = self.white if self.turn == "white" else self.black
+        if index < 0 or index // 6 != color:
+            return False
+        if not (self.pseudo_targets(square) >> target) & 1:
+            return False
+        if self.position_info is not None:
+            return bool((self.legal_target_mask(square) >> target) & 1)
+        # One move on its own is cheaper to try than working out checks and pins for the position
+        self.make_move(current_row, current_column, next_row, next_column)
+        safe = not self.is_in_check(color, include_king=index % 6 == 5)
+        self.unmake_move()
+        return safe
+
+    def make_move(self, current_row, current_column, next_row, next_column) -> None:
+        start = current_row * 8 + current_column
+        end = next_row * 8 + next_column
+        index = self.squares[start]
+        captured = self.squares[end]
+        placed = index
+        # Promoting pawn to queen
+        if (index == 0 and next_row == 7) or (index == 6 and next_row == 0):
+            placed = index + 4
+
+        self.undo_stack.append((start, end, index, captured, placed,
+                                self.turn, self.current_turn, self.zobrist_key))
+        self.clear_caches()
+
+        color = index // 6
+        start_bit = 1 << start
+        end_bit = 1 << end
+        if captured >= 0:
+            self.bitboards[captured] ^= end_bit
+            self.occupancy[captured // 6] ^= end_bit
+        self.bitboards[index] ^= start_bit
+        self.bitboards[placed] |= end_bit
+        self.occupancy[color] ^= start_bit | end_bit
+        self.squares[start] = -1
+        self.squares[end] = placed
+
+        self.zobrist_key ^= self.zobrist_pieces[index][start] ^ self.zobrist_pieces[placed][end]
+        if captured >= 0:
+            self.zobrist_key ^= self.zobrist_pieces[captured][end]
+        self.update_square_totals(start, end, index, captured, placed, 1)
+
+        self.change_turn()
+        self.current_turn += 1
+        if self.debug_evaluation:
+            self.check_evaluation_totals()
+
+    def update_square_totals(self, start, end, index, captured, placed, sign: int) -> None:
+        """update_evaluation_totals by square and piece index"""
+        color = index // 6
+        self.material_totals[color] += sign * (self.piece_order[placed][1] - self.piece_order[index][1])
+        self.square_score_totals[color] += sign * (self.square_scores[placed][end] - self.square_scores[index][start])
+        if captured >= 0:
+            self.material_totals[1 - color] -= sign * self.piece_order[captured][1]
+            self.square_score_totals[1 - color] -= sign * self.square_scores[captured][end]
+
+    def unmake_move(self) -> tuple:
+        start, end, index, captured, placed, turn, current_turn, zobrist_key = self.undo_stack.pop()
+        self.clear_caches()
+
+        color = index // 6
+        start_bit = 1 << start
+        end_bit = 1 << end
+        self.bitboards[placed] ^= end_bit
+        self.bitboards[index] |= start_bit
+        self.occupancy[color] ^= start_bit | end_bit
+        if captured >= 0:
+            self.bitboards[captured] |= end_bit
+            self.occupancy[captured // 6] |= end_bit
+        self.squares[start] = index
+        self.squares[end] = captured
+        self.update_square_totals(start, end, index, captured, placed, -1)
+
+        self.turn = turn
+        self.current_turn = current_turn
+        self.zobrist_key = zobrist_key
+        if self.debug_evaluation:
+            self.check_evaluation_totals()
+        return (start // 8, start % 8, end // 8, end % 8)
+
+    def played_moves(self, start: int = 0) -> list:
+        return [(record[0] // 8, record[0] % 8, record[1] // 8, record[1] % 8) for record in self.undo_stack[start:]]
+
+    def manual_move(self, current_row, current_column, next_row, next_column):
+        self.make_move(current_row, current_column, next_row, next_column)
+
+
+class BitBoardAIVMCTS(BitBoardHumanVHuman, chess.AIVMCTS):
+    """AIVMCTS running on the bitboard backend"""
@@ -1,60 +1,148 @@
 import random
 import json
-import copy
+import math
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from evaluation import PIECE_SCORES, SQUARE_SCORES
+from transposition import TranspositionTable
+
+# Square offsets used by the move generator
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+LINE_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+DIAGONAL_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+# FEN letter of each piece sign and back
+FEN_LETTERS = {'p': 'p', 'kn': 'n', 'b': 'b', 'r': 'r', 'q': 'q', 'ki': 'k'}
+FEN_SIGNS = {letter: sign for sign, letter in FEN_LETTERS.items()}
+
+# Zobrist keys, one random 64-bit number per (sign, colour) and square plus one for black to move.
+# A fixed seed keeps the keys the same in every process.
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {(sign, color): [_zobrist_random.getrandbits(64) for square in range(64)]
+                  for sign in ('p', 'kn', 'b', 'r', 'q', 'ki') for color in (0, 1)}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+# Colours and pieces. A piece is (sign, value, colour) and an empty square is NONE_PIECE.
+WHITE = 0
+BLACK = 1
+NONE_PIECE = (0, 0, 3)
+
+PAWN_SIGN, PAWN_VALUE = 'p', 1
+KNIGHT_SIGN, KNIGHT_VALUE = 'kn', 2
+BISHOP_SIGN, BISHOP_VALUE = 'b', 2
+ROOK_SIGN, ROOK_VALUE = 'r', 5
+QUEEN_SIGN, QUEEN_VALUE = 'q', 1
+KING_SIGN, KING_VALUE = 'ki', 1
+
+WHITE_PAWN, BLACK_PAWN = (PAWN_SIGN, PAWN_VALUE, WHITE), (PAWN_SIGN, PAWN_VALUE, BLACK)
+WHITE_KNIGHT, BLACK_KNIGHT = (KNIGHT_SIGN, KNIGHT_VALUE, WHITE), (KNIGHT_SIGN, KNIGHT_VALUE, BLACK)
+WHITE_BISHOP, BLACK_BISHOP = (BISHOP_SIGN, BISHOP_VALUE, WHITE), (BISHOP_SIGN, BISHOP_VALUE, BLACK)
+WHITE_ROOK, BLACK_ROOK = (ROOK_SIGN, ROOK_VALUE, WHITE), (ROOK_SIGN, ROOK_VALUE, BLACK)
+WHITE_QUEEN, BLACK_QUEEN = (QUEEN_SIGN, QUEEN_VALUE, WHITE), (QUEEN_SIGN, QUEEN_VALUE, BLACK)
+WHITE_KING, BLACK_KING = (KING_SIGN, KING_VALUE, WHITE), (KING_SIGN, KING_VALUE, BLACK)
+
+# Small integer code per piece, used by Position and to_compact/from_compact
+PIECE_CODES = (NONE_PIECE,
+               WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING,
+               BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING)
+PIECE_CODE_OF = {piece: code for code, piece in enumerate(PIECE_CODES)}
+
+
+class Position():
+    """
+    A position on its own, for keeping many of them around (search trees, replay buffers):
+    one piece code per square in a 64 byte buffer, square = row * 8 + column, plus the side to
+    move (0 white, 1 black) and current_turn. copy() is a single buffer copy.
+    """
+    __slots__ = ("squares", "turn", "current_turn")
+
+    def __init__(self, squares=None, turn: int = WHITE, current_turn: int = 0):
+        self.squares = bytearray(squares) if squares is not None else bytearray(64)
+        self.turn = turn
+        self.current_turn = current_turn
+
+    def copy(self):
+        return Position(self.squares, self.turn, self.current_turn)
+
+    def piece_at(self, row: int, column: int) -> tuple:
+        return PIECE_CODES[self.squares[row * 8 + column]]
+
+    @property
+    def game_board(self) -> tuple:
+        """Read-only 8x8 view of piece tuples, laid out like BoardHumanVHuman.game_board"""
+        return tuple(tuple(PIECE_CODES[code] for code in self.squares[row * 8:row * 8 + 8]) for row in range(8))
+
+    def to_compact(self) -> bytes:
+        """The 67 byte format of BoardHumanVHuman.to_compact"""
+        return bytes(self.squares) + bytes([self.turn]) + self.current_turn.to_bytes(2, "little")
+
+    @classmethod
+    def from_compact(cls, data: bytes):
+        return cls(data[:64], data[64], int.from_bytes(data[65:67], "little"))
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, Position) and self.squares == other.squares
+                and self.turn == other.turn and self.current_turn == other.current_turn)
+
+    def __repr__(self) -> str:
+        return f"Position({self.to_compact()!r})"
+
 
 # Defining board class
 class BoardHumanVHuman():
-    def __init__(self):
-
-
-        self.current_turn = 0
-        self.max_turn = 300
-
-        self.turn = "white"
+    # The piece constants are shared by every board instead of being set up per instance
+    none_piece = NONE_PIECE
 
-        self.none_piece = (0,0,3)
+    black = BLACK
+    white = WHITE
 
-        self.black = 1
-        self.white = 0
+    pawn_value = PAWN_VALUE
+    pawn_sign = PAWN_SIGN
 
-        self.pawn_value = 1
-        self.pawn_sign = 'p'
+    knight_value = KNIGHT_VALUE
+    knight_sign = KNIGHT_SIGN
 
-        self.knight_value = 2
-        self.knight_sign = 'kn'
+    bishop_value = BISHOP_VALUE
+    bishop_sign = BISHOP_SIGN
 
-        self.bishop_value = 2
-        self.bishop_sign = 'b'
+    rook_value = ROOK_VALUE
+    rook_sign = ROOK_SIGN
 
-        self.rook_value = 5
-        self.rook_sign = 'r'
+    queen_value = QUEEN_VALUE
+    queen_sign = QUEEN_SIGN
 
-        self.queen_value = 1
-        self.queen_sign = 'q'
+    king_value = KING_VALUE
+    king_sign = KING_SIGN
 
-        self.king_value = 1
-        self.king_sign = 'ki'
+    white_pawn, black_pawn = WHITE_PAWN, BLACK_PAWN
+    white_knight, black_knight = WHITE_KNIGHT, BLACK_KNIGHT
+    white_bishop, black_bishop = WHITE_BISHOP, BLACK_BISHOP
+    white_rook, black_rook = WHITE_ROOK, BLACK_ROOK
+    white_queen, black_queen = WHITE_QUEEN, BLACK_QUEEN
+    white_king, black_king = WHITE_KING, BLACK_KING
 
-        self.white_pawn = (self.pawn_sign, self.pawn_value, self.white)
-        self.black_pawn = (self.pawn_sign, self.pawn_value, self.black)
-        
-        self.white_knight = (self.knight_sign, self.knight_value, self.white)
-        self.black_knight = (self.knight_sign, self.knight_value, self.black)
+    piece_codes = PIECE_CODES
+    piece_code_of = PIECE_CODE_OF
 
-        self.white_bishop = (self.bishop_sign, self.bishop_value, self.white)
-        self.black_bishop = (self.bishop_sign, self.bishop_value, self.black)
+    def __init__(self):
 
-        self.white_rook = (self.rook_sign, self.rook_value, self.white)
-        self.black_rook = (self.rook_sign, self.rook_value, self.black)
 
-        self.white_queen = (self.queen_sign, self.queen_value, self.white)
-        self.black_queen = (self.queen_sign, self.queen_value, self.black)
+        self.current_turn = 0
+        self.max_turn = 300
 
-        self.white_king = (self.king_sign, self.king_value, self.white)
-        self.black_king = (self.king_sign, self.king_value, self.black)
+        self.turn = "white"
 
         self.game_board = self.make_board()
         self.future_board = self.game_board
+
+        # Moves played with make_move, newest last, so they can be taken back
+        self.undo_stack = []
+
+        # When set, make_move and unmake_move check the running evaluation totals against a recount
+        self.debug_evaluation = False
         
     def make_board(self):
         self.game_board = [[self.none_piece for j in range(8)] for i in range(8)]
@@ -77,146 +165,104 @@ class BoardHumanVHuman():
                 self.game_board[0][i] = self.white_king
                 self.game_board[7][i] = self.black_king
 
+        self.reset_incremental_state()
         return self.game_board 
 
-    def is_black_check(self) -> bool:
-        # Finding Black king, White rooks, White Queen, White bishop and white knight
-        rooks_pos = []
-        bishop_pos = []
-        queen_pos = []
-        knight_pos = []
+    def reset_incremental_state(self) -> None:
+        """
+        Rebuilds what make_move keeps up to date (king_squares, piece_squares, zobrist_key)
+        from game_board after the board is replaced
+        """
+        # piece_squares[color] holds the (row, column) of every piece of that colour
+        self.clear_caches()
+        self.piece_squares = [set(), set()]
+        self.king_squares = [None, None]
         for row in range(8):
             for column in range(8):
-                if self.game_board[row][column] == self.black_king:
-                    king_pos = (row,column)
-                elif self.game_board[row][column] == self.white_rook:
-                    rooks_pos.append((row,column))
-                elif self.game_board[row][column] == self.white_queen:
-                    queen_pos.append((row,column))
-                elif self.game_board[row][column] == self.white_bishop:
-                    bishop_pos.append((row,column))
-                elif self.game_board[row][column] == self.white_knight:
-                    knight_pos.append((row,column))
-
-            
-        for pos in rooks_pos:
-            if self.is_on_line_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-        for pos in bishop_pos:
-            if self.is_on_diagonal_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-        for pos in queen_pos:
-            if self.is_on_line_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-            if self.is_on_diagonal_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-
+                piece = self.game_board[row][column]
+                if piece[2] in (self.white, self.black):
+                    self.piece_squares[piece[2]].add((row, column))
+                    if piece[0] == self.king_sign:
+                        self.king_squares[piece[2]] = (row, column)
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material_totals, self.square_score_totals = self.compute_evaluation_totals()
+
+    def clear_caches(self) -> None:
+        """Forgets everything cached about the current position, called whenever the position changes"""
+        self.position_info = None
+        # Legal moves and game_status() of the current position, worked out on first use
+        self.legal_moves = None
+        self.status = None
+        self.status_known = False
+
+    def compute_evaluation_totals(self) -> tuple:
+        """
+        Per colour sums from scratch: the game's piece values (material_totals) and centipawn
+        value plus piece-square bonus (square_score_totals). make_move keeps both up to date.
+        """
+        material = [0, 0]
+        square_scores = [0, 0]
+        for color in (self.white, self.black):
+            for row, column in self.piece_squares[color]:
+                piece = self.game_board[row][column]
+                material[color] += piece[1]
+                square_scores[color] += SQUARE_SCORES[(piece[0], color)][row * 8 + column]
+        return material, square_scores
+
+    def check_evaluation_totals(self) -> None:
+        material, square_scores = self.compute_evaluation_totals()
+        assert self.material_totals == material, f"material {self.material_totals} != {material}"
+        assert self.square_score_totals == square_scores, f"square scores {self.square_score_totals} != {square_scores}"
+
+    def compute_zobrist_key(self) -> int:
+        """Zobrist key of the position computed from scratch, make_move keeps zobrist_key equal to it"""
+        key = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.game_board[row][column]
+                if piece != self.none_piece:
+                    key ^= ZOBRIST_PIECES[(piece[0], piece[2])][row * 8 + column]
+        if self.turn == "black":
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+
+    def is_king_attacked(self, color: int) -> bool:
+        """Checks if the king of color is attacked, reading the enemy pieces from the piece lists"""
+        king_pos = self.king_squares[color]
+        if king_pos is None:
+            return False
+        king_row, king_column = king_pos
 
-        # Checking white pawn move
-        pawn_attack_offsets = [(-1, -1), (-1, 1)]  # pawns attack diagonally downward
-        for dr, dc in pawn_attack_offsets:
-            r, c = king_pos[0] + dr, king_pos[1] + dc
-            if 0 <= r < 8 and 0 <= c < 8:
-                if self.game_board[r][c] == self.white_pawn:
+        for pos in self.piece_squares[1 - color]:
+            sign = self.game_board[pos[0]][pos[1]][0]
+            if sign == self.knight_sign:
+                if (abs(pos[0] - king_row), abs(pos[1] - king_column)) in ((1, 2), (2, 1)):
                     return True
-        
-        # Checking for knights
-        knights_check_pos = []
-        # Down
-        knights_check_pos.append((king_pos[0] -2,king_pos[1] -1)) 
-        knights_check_pos.append((king_pos[0] -2, king_pos[1] +1))
-        
-        # Left 
-        knights_check_pos.append((king_pos[0] - 1, king_pos[1] -2))
-        knights_check_pos.append((king_pos[0] + 1, king_pos[1] -2))
-
-        # Up
-        knights_check_pos.append((king_pos[0] + 2, king_pos[1] -1))
-        knights_check_pos.append((king_pos[0] + 2, king_pos[1] +1))
-
-        # Right
-        knights_check_pos.append((king_pos[0] + 1, king_pos[1] +2))
-        knights_check_pos.append((king_pos[0] - 1, king_pos[1] +2))
-    
-        for i in knight_pos:
-            if i in knights_check_pos:
-                return True
+            elif sign == self.pawn_sign:
+                # White pawns attack upwards and black pawns downwards
+                pawn_direction = 1 if color == self.black else -1
+                if king_row - pos[0] == pawn_direction and abs(king_column - pos[1]) == 1:
+                    return True
+            elif sign in (self.rook_sign, self.bishop_sign, self.queen_sign):
+                on_line = pos[0] == king_row or pos[1] == king_column
+                on_diagonal = abs(pos[0] - king_row) == abs(pos[1] - king_column)
+                if ((on_line and sign != self.bishop_sign) or (on_diagonal and sign != self.rook_sign)):
+                    # Sliders only need a free path, so this works whoever's turn it is
+                    if self.is_path_free(current_row=king_row, current_column=king_column,
+                                         next_row=pos[0], next_column=pos[1]):
+                        return True
         return False
 
+    def is_black_check(self) -> bool:
+        return self.is_king_attacked(self.black)
+
     def blank_board(self):
         self.game_board = [[self.none_piece for j in range(8)] for i in range(8)]
+        self.undo_stack = []
+        self.reset_incremental_state()
 
     def is_white_check(self) -> bool:
-        # Finding White king, Black rooks, Black Queen, Black bishop and black knight
-        rooks_pos = []
-        bishop_pos = []
-        queen_pos = []
-        knight_pos = []
-        for row in range(8):
-            for column in range(8):
-
-                if self.game_board[row][column] == self.white_king:
-                    king_pos = (row,column)
-                elif self.game_board[row][column] == self.black_rook:
-                    rooks_pos.append((row,column))
-                elif self.game_board[row][column] == self.black_queen:
-                    queen_pos.append((row,column))
-                elif self.game_board[row][column] == self.black_bishop:
-                    bishop_pos.append((row,column))
-                elif self.game_board[row][column] == self.black_knight:
-                    knight_pos.append((row,column))
-
-        for pos in rooks_pos:
-            if self.is_on_line_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-        for pos in bishop_pos:
-            if self.is_on_diagonal_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-        for pos in queen_pos:
-            if self.is_on_line_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-            if self.is_on_diagonal_and_free(current_row=king_pos[0], current_column=king_pos[1], 
-                                        next_row=pos[0], next_column=pos[1]):
-                return True
-
-
-        # Checking for pawns
-        pawn_attack_offsets = [(1, -1), (1, 1)]
-        for dr, dc in pawn_attack_offsets:
-            r, c = king_pos[0] + dr, king_pos[1] + dc
-            if 0 <= r < 8 and 0 <= c < 8:
-                if self.game_board[r][c] == self.black_pawn:
-                    return True
-        
-        # Checking for knights
-        knights_check_pos = []
-        # Down
-        knights_check_pos.append((king_pos[0] -2,king_pos[1] -1)) 
-        knights_check_pos.append((king_pos[0] -2, king_pos[1] +1))
-        
-        # Left 
-        knights_check_pos.append((king_pos[0] - 1, king_pos[1] -2))
-        knights_check_pos.append((king_pos[0] + 1, king_pos[1] -2))
-
-        # Up
-        knights_check_pos.append((king_pos[0] + 2, king_pos[1] -1))
-        knights_check_pos.append((king_pos[0] + 2, king_pos[1] +1))
-
-        # Right
-        knights_check_pos.append((king_pos[0] + 1, king_pos[1] +2))
-        knights_check_pos.append((king_pos[0] - 1, king_pos[1] +2))
-    
-        for i in knight_pos:
-            if i in knights_check_pos:
-                return True
-        return False
+        return self.is_king_attacked(self.white)
 
     def is_free(self, next_row, next_column):
         if self.game_board[next_row][next_column] == self.none_piece:
@@ -224,14 +270,23 @@ class BoardHumanVHuman():
         else:
             return False
 
+    def is_path_free(self, current_row: int, current_column: int, next_row: int, next_column: int) -> bool:
+        """
+        Checks that every square strictly between two squares on a line or diagonal is free.
+        The end squares are not looked at, so the answer does not depend on self.turn.
+        """
+        step_row = (next_row > current_row) - (next_row < current_row)
+        step_column = (next_column > current_column) - (next_column < current_column)
+        row, column = current_row + step_row, current_column + step_column
+        while (row, column) != (next_row, next_column):
+            if self.game_board[row][column] != self.none_piece:
+                return False
+            row, column = row + step_row, column + step_column
+        return True
+
     def is_kings_in_proximity(self, next_row, next_column) -> bool:
         # Locating Kings
-        for row in range(8):
-            for column in range(8):
-                if self.game_board[row][column] == self.white_king:
-                    white_pos = (row, column)
-                if self.game_board[row][column] == self.black_king:
-                    black_pos = (row, column)
+        white_pos, black_pos = self.king_squares
         if self.turn == "white":
             white_pos = (next_row, next_column)
         else:
@@ -501,26 +556,6 @@ class BoardHumanVHuman():
             if self.game_board[next_row][next_column][2] == self.black:
                 return False
 
-        # If check, checks if move unchecks
-        if self.turn == "white":
-            if self.is_white_check():
-                # copies current state 
-                new_game = copy.deepcopy(self)
-                current_piece = new_game.game_board[current_row][current_column]
-                new_game.game_board[next_row][next_column] = current_piece
-                new_game.game_board[current_row][current_column] = self.none_piece
-                if new_game.is_white_check():
-                    return False
-        else:
-            if self.is_black_check():
-                # copies current state
-                new_game = copy.deepcopy(self)
-                current_piece = new_game.game_board[current_row][current_column]
-                new_game.game_board[next_row][next_column] = current_piece
-                new_game.game_board[current_row][current_column] = self.none_piece
-                if new_game.is_black_check():
-                    return False
-
         # Checks pawn movement
         if (self.game_board[current_row][current_column][0] == self.pawn_sign):
             if (self.is_pawn_move_legal(current_row= current_row, current_column= current_column, 
@@ -557,54 +592,242 @@ class BoardHumanVHuman():
                 return False
             
         # Checking if move makes own king check
-        if self.turn == 'white':
-            new_game = copy.deepcopy(self)
-            current_piece = new_game.game_board[current_row][current_column]
-            new_game.game_board[next_row][next_column] = current_piece
-            new_game.game_board[current_row][current_column] = self.none_piece
-            if new_game.is_white_check():
-                return False
-        else:
-            new_game = copy.deepcopy(self)
-            current_board = new_game.game_board
-            current_piece = new_game.game_board[current_row][current_column]
-            new_game.game_board[next_row][next_column] = current_piece
-            new_game.game_board[current_row][current_column] = self.none_piece
-            if new_game.is_black_check():
-                return False
+        if self.is_king_safe_after(current_row, current_column, next_row, next_column) == False:
+            return False
         # Getting at this point means the move is valid
         return True
         
-    def action_space(self):
-        all_moves = []
+    def analyze_position(self) -> dict:
+        """
+        Works out once per position what is needed to validate every move of the side to move:
+        the squares the enemy attacks, the enemy pieces giving check, the squares that answer the check
+        and the pinned pieces with the squares they can still move to. Cached until a move is played.
+        """
+        if self.position_info is not None:
+            return self.position_info
+
+        color = self.white if self.turn == "white" else self.black
+        enemy = 1 - color
+        king_pos = self.king_squares[color]
+        attacked = set()
+        checkers = []
+        evasions = None
+
+        for pos in self.piece_squares[enemy]:
+            sign = self.game_board[pos[0]][pos[1]][0]
+            if sign == self.pawn_sign:
+                pawn_direction = 1 if enemy == self.white else -1
+                reach = [(pos[0] + pawn_direction, pos[1] - 1), (pos[0] + pawn_direction, pos[1] + 1)]
+            elif sign == self.knight_sign:
+                reach = [(pos[0] + dr, pos[1] + dc) for dr, dc in KNIGHT_OFFSETS]
+            elif sign == self.king_sign:
+                # The enemy king's squares are what is_kings_in_proximity forbids
+                attacked.update((pos[0] + dr, pos[1] + dc) for dr, dc in KING_OFFSETS)
+                continue
+            else:
+                directions = []
+                if sign in (self.rook_sign, self.queen_sign):
+                    directions += LINE_DIRECTIONS
+                if sign in (self.bishop_sign, self.queen_sign):
+                    directions += DIAGONAL_DIRECTIONS
+                for dr, dc in directions:
+                    ray = []
+                    r, c = pos[0] + dr, pos[1] + dc
+                    while 0 <= r < 8 and 0 <= c < 8:
+                        ray.append((r, c))
+                        if (r, c) == king_pos:
+                            # Check can be answered by capturing or blocking anywhere on the ray
+                            checkers.append(pos)
+                            evasions = set(ray[:-1])
+                            evasions.add(pos)
+                        # The ray goes through our own king so it cannot step back along it
+                        elif self.game_board[r][c] != self.none_piece:
+                            break
+                        r, c = r + dr, c + dc
+                    attacked.update(ray)
+                continue
 
-        for row in range(8):
-            for col in range(8):
-                for next_row in range(8):
-                    for next_col in range(8):
-                        if (row, col) == (next_row, next_col):
-                            continue  # Skip moves to the same square
+            for square in reach:
+                if 0 <= square[0] < 8 and 0 <= square[1] < 8:
+                    attacked.add(square)
+                    if square == king_pos:
+                        checkers.append(pos)
+                        evasions = {pos}
+
+        # Pins, walking out from our king to the first own piece and the enemy slider behind it
+        pins = {}
+        if king_pos is not None:
+            for directions, pinner_signs in ((LINE_DIRECTIONS, (self.rook_sign, self.queen_sign)),
+                                             (DIAGONAL_DIRECTIONS, (self.bishop_sign, self.queen_sign))):
+                for dr, dc in directions:
+                    ray = []
+                    pinned = None
+                    r, c = king_pos[0] + dr, king_pos[1] + dc
+                    while 0 <= r < 8 and 0 <= c < 8:
+                        ray.append((r, c))
+                        piece = self.game_board[r][c]
+                        if piece != self.none_piece:
+                            if piece[2] == color:
+                                if pinned is not None:
+                                    break
+                                pinned = (r, c)
+                            else:
+                                if pinned is not None and piece[0] in pinner_signs:
+                                    pins[pinned] = set(ray)
+                                break
+                        r, c = r + dr, c + dc
+
+        self.position_info = {"attacked": attacked, "checkers": checkers,
+                              "evasions": evasions, "pins": pins}
+        return self.position_info
+
+    def is_king_safe_after(self, current_row: int, current_column: int, next_row: int, next_column: int) -> bool:
+        """Checks that a move does not leave the mover's king in check, using analyze_position"""
+        info = self.analyze_position()
+        target = (next_row, next_column)
+
+        if self.game_board[current_row][current_column][0] == self.king_sign:
+            return target not in info["attacked"]
+        # Only the king can answer a double check
+        if len(info["checkers"]) > 1:
+            return False
+        if info["evasions"] is not None and target not in info["evasions"]:
+            return False
+        pin_ray = info["pins"].get((current_row, current_column))
+        if pin_ray is not None and target not in pin_ray:
+            return False
+        return True
 
-                        if self.is_move_valid(
-                            current_row=row, current_column=col,
-                            next_row=next_row, next_column=next_col
-                        ):
-                            all_moves.append((row, col, next_row, next_col))
+    def candidate_targets(self, row: int, column: int) -> list:
+        """
+        Lists the squares the piece on (row, column) could reach on an empty-enough board.
+        The list is pseudo-legal and sorted, legality is checked by is_move_valid.
+        """
+        sign, _, color = self.game_board[row][column]
+        targets = []
+
+        if sign == self.pawn_sign:
+            direction = 1 if color == self.white else -1
+            start_row = 1 if color == self.white else 6
+            next_row = row + direction
+            if 0 <= next_row < 8:
+                for next_column in (column - 1, column, column + 1):
+                    if 0 <= next_column < 8:
+                        targets.append((next_row, next_column))
+            if row == start_row:
+                targets.append((row + 2 * direction, column))
+
+        elif sign == self.knight_sign:
+            for dr, dc in KNIGHT_OFFSETS:
+                r, c = row + dr, column + dc
+                if 0 <= r < 8 and 0 <= c < 8:
+                    targets.append((r, c))
+
+        elif sign == self.king_sign:
+            for dr, dc in KING_OFFSETS:
+                r, c = row + dr, column + dc
+                if 0 <= r < 8 and 0 <= c < 8:
+                    targets.append((r, c))
+
+        else:
+            # Sliders walk each ray up to and including the first occupied square
+            directions = []
+            if sign in (self.rook_sign, self.queen_sign):
+                directions += LINE_DIRECTIONS
+            if sign in (self.bishop_sign, self.queen_sign):
+                directions += DIAGONAL_DIRECTIONS
+            for dr, dc in directions:
+                r, c = row + dr, column + dc
+                while 0 <= r < 8 and 0 <= c < 8:
+                    targets.append((r, c))
+                    if self.game_board[r][c] != self.none_piece:
+                        break
+                    r, c = r + dr, c + dc
+
+        targets.sort()
+        return targets
 
-        return all_moves
+    def action_space(self):
+        """Legal moves of the side to move. The list is cached until the position changes, callers get a copy."""
+        if self.legal_moves is None:
+            self.legal_moves = self.generate_moves()
+        return list(self.legal_moves)
+
+    def generate_moves(self) -> list:
+        return list(self.scan_legal_moves())
+
+    def scan_legal_moves(self):
+        # Starts from the pieces of the side to move instead of scanning all 64x64 square pairs.
+        # Pieces and targets are walked in order so the moves come out in the order of the full scan.
+        own_color = self.white if self.turn == "white" else self.black
+
+        for row, col in sorted(self.piece_squares[own_color]):
+            for next_row, next_col in self.candidate_targets(row, col):
+                if self.is_move_valid(
+                    current_row=row, current_column=col,
+                    next_row=next_row, next_column=next_col
+                ):
+                    yield (row, col, next_row, next_col)
+
+    def iter_legal_moves(self):
+        """
+        Yields the legal moves one at a time, in action_space order. Only as many moves are worked out
+        as the caller takes, unless the list is already cached. The board must not change meanwhile.
+        """
+        if self.legal_moves is not None:
+            return iter(self.legal_moves)
+        return self.scan_legal_moves()
+
+    def has_legal_move(self) -> bool:
+        """Whether the side to move can move at all, stopping at the first legal move found"""
+        if self.legal_moves is not None:
+            return len(self.legal_moves) > 0
+        for _ in self.iter_legal_moves():
+            return True
+        return False
 
+    def sample_legal_move(self, rng=random):
+        """
+        A legal move picked uniformly at random in one pass over the moves (reservoir sampling),
+        without building the move list. None when there is no legal move.
+        """
+        if self.legal_moves is not None:
+            return rng.choice(self.legal_moves) if self.legal_moves else None
+        chosen = None
+        count = 0
+        for move in self.scan_legal_moves():
+            count += 1
+            # The count-th move replaces the choice with probability 1/count
+            if rng.random() * count < 1:
+                chosen = move
+        return chosen
 
     def is_checkmate(self):
-        if self.turn == "white":
-            return (len(self.action_space()) == 0 and self.is_white_check())
-        else:
-            return (len(self.action_space()) == 0 and self.is_black_check())
+        return self.game_status() == "checkmate"
+
+    def game_status(self):
+        """
+        "checkmate", "stalemate" or "max_turn" once the game is over, None while it goes on.
+        Cached until the position changes, so calling it every frame is cheap, and only looks for
+        the first legal move.
+        """
+        if not self.status_known:
+            if not self.has_legal_move():
+                in_check = self.is_white_check() if self.turn == "white" else self.is_black_check()
+                self.status = "checkmate" if in_check else "stalemate"
+            elif self.current_turn >= self.max_turn:
+                self.status = "max_turn"
+            else:
+                self.status = None
+            self.status_known = True
+        return self.status
 
     def change_turn(self) -> None:
         if self.turn == "white":
             self.turn = "black"
         else:
             self.turn = "white"
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
 
     def random_action(self):
         current_action_space = self.action_space()
@@ -616,12 +839,15 @@ class BoardHumanVHuman():
         return current_action_space[max(random.randint(0, len(current_action_space)-1),0)]
     
     def make_board_from_json(self, json_data):
-        self.game_board = json.loads(json_data)
+        # JSON has no tuples, so the pieces are turned back into tuples to compare equal
+        self.game_board = [[tuple(piece) for piece in row] for row in json.loads(json_data)]
+        self.undo_stack = []
+        self.reset_incremental_state()
 
     def is_game_drawn(self):
         if self.current_turn >= self.max_turn:
             return True
-        elif len(self.action_space()) == 0:
+        elif not self.has_legal_move():
             return True
         elif any(row for row in self.game_board[0]):
             True
@@ -631,6 +857,96 @@ class BoardHumanVHuman():
         for row in range(8):
             for column in range(8):
                 self.game_board[row][column] = tuple(dict["game_board"][row][column])
+        self.undo_stack = []
+        self.reset_incremental_state()
+
+    def position(self):
+        """The current position as a compact Position"""
+        board = self.game_board
+        squares = bytes(PIECE_CODE_OF[board[row][column]] for row in range(8) for column in range(8))
+        return Position(squares, WHITE if self.turn == "white" else BLACK, self.current_turn)
+
+    def set_position(self, position) -> None:
+        """Loads a Position, the undo stack starts empty"""
+        self.turn = "white" if position.turn == WHITE else "black"
+        self.current_turn = position.current_turn
+        self.set_board({"game_board": position.game_board})
+
+    def to_compact(self) -> bytes:
+        """Position as 67 bytes: one piece code per square, side to move, then current_turn"""
+        return self.position().to_compact()
+
+    def from_compact(self, data: bytes) -> None:
+        """Loads a position written by to_compact, the undo stack starts empty"""
+        self.set_position(Position.from_compact(data))
+
+    def to_fen(self) -> str:
+        """
+        FEN of the position. There is no castling or en passant in this game, so those fields are '-',
+        and the halfmove clock is not tracked so it is always 0.
+        """
+        ranks = []
+        for row in range(7, -1, -1):
+            rank = ""
+            empty = 0
+            for column in range(8):
+                piece = self.game_board[row][column]
+                if piece == self.none_piece:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                letter = FEN_LETTERS[piece[0]]
+                rank += letter.upper() if piece[2] == self.white else letter
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        side = "w" if self.turn == "white" else "b"
+        return f"{'/'.join(ranks)} {side} - - 0 {self.current_turn // 2 + 1}"
+
+    def from_fen(self, fen: str) -> None:
+        """
+        Loads a FEN or EPD position. Castling and en passant fields are ignored, and current_turn
+        is worked out from the fullmove number. The undo stack starts empty.
+        Raises ValueError for malformed input or a position without exactly one king per colour.
+        """
+        fields = fen.split()
+        if len(fields) < 2 or fields[1] not in ("w", "b"):
+            raise ValueError(f"Not a FEN position: {fen!r}")
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError(f"FEN needs 8 ranks: {fen!r}")
+
+        pieces = {(piece[0], piece[2]): piece for piece in self.piece_codes[1:]}
+        board = [[self.none_piece for j in range(8)] for i in range(8)]
+        for index, rank in enumerate(ranks):
+            row = 7 - index
+            column = 0
+            for letter in rank:
+                if letter.isdigit():
+                    column += int(letter)
+                    continue
+                sign = FEN_SIGNS.get(letter.lower())
+                if sign is None or column > 7:
+                    raise ValueError(f"Bad FEN rank {rank!r}")
+                color = self.white if letter.isupper() else self.black
+                board[row][column] = pieces[(sign, color)]
+                column += 1
+            if column != 8:
+                raise ValueError(f"Bad FEN rank {rank!r}")
+        # The move rules need both kings on the board
+        for king in (self.white_king, self.black_king):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError(f"FEN needs exactly one king per colour: {fen!r}")
+
+        fullmove = 1
+        # FEN has halfmove and fullmove counters, EPD has operations in their place
+        if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+            fullmove = max(1, int(fields[5]))
+        self.turn = "white" if fields[1] == "w" else "black"
+        self.current_turn = 2 * (fullmove - 1) + (1 if self.turn == "black" else 0)
+        self.set_board({"game_board": board})
     
     def move(self):
         while True:
@@ -664,23 +980,7 @@ class BoardHumanVHuman():
                 continue
             break
 
-        current_piece = self.game_board[current_row][current_column]
-        self.game_board[current_row][current_column] = self.none_piece
-
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
-
-        self.game_board[next_row][next_column] = current_piece
-
-            
-
-        self.change_turn()
-        self.current_turn += 1
+        self.make_move(current_row, current_column, next_row, next_column)
 
     def move_api(self, current_row, current_column, next_row, next_column):
         if current_row not in [0,1,2,3,4,5,6,7]:
@@ -697,23 +997,123 @@ class BoardHumanVHuman():
         if self.is_move_valid(current_row, current_column, next_row, next_column) == False:
             return 2
 
+        self.make_move(current_row, current_column, next_row, next_column)
+        return 0
+
+    def make_move(self, current_row, current_column, next_row, next_column) -> None:
+        """
+        Plays a move in place without validating it and pushes what is needed to take it back onto undo_stack.
+        """
         current_piece = self.game_board[current_row][current_column]
+        captured_piece = self.game_board[next_row][next_column]
+        promotion = None
 
         # Promoting pawn
         # White
         if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
+            promotion = self.white_queen
         # Black
         elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
+            promotion = self.black_queen
 
-        self.game_board[current_row][current_column] = self.none_piece
-        self.game_board[next_row][next_column] = current_piece
+        self.undo_stack.append((current_row, current_column, next_row, next_column, current_piece,
+                                captured_piece, promotion, self.turn, self.current_turn, self.zobrist_key))
+        self.clear_caches()
 
+        self.game_board[current_row][current_column] = self.none_piece
+        self.game_board[next_row][next_column] = promotion if promotion is not None else current_piece
+
+        # Keeping the piece lists and king squares up to date
+        color = current_piece[2]
+        self.piece_squares[color].remove((current_row, current_column))
+        self.piece_squares[color].add((next_row, next_column))
+        if captured_piece != self.none_piece:
+            self.piece_squares[1 - color].discard((next_row, next_column))
+        if current_piece[0] == self.king_sign:
+            self.king_squares[color] = (next_row, next_column)
+
+        self.zobrist_key ^= ZOBRIST_PIECES[(current_piece[0], color)][current_row * 8 + current_column]
+        placed_piece = promotion if promotion is not None else current_piece
+        self.zobrist_key ^= ZOBRIST_PIECES[(placed_piece[0], color)][next_row * 8 + next_column]
+        if captured_piece != self.none_piece:
+            self.zobrist_key ^= ZOBRIST_PIECES[(captured_piece[0], captured_piece[2])][next_row * 8 + next_column]
+
+        self.update_evaluation_totals(current_row, current_column, next_row, next_column,
+                                      current_piece, placed_piece, captured_piece, 1)
 
         self.change_turn()
         self.current_turn += 1
-        return 0
+        if self.debug_evaluation:
+            self.check_evaluation_totals()
+
+    def update_evaluation_totals(self, current_row, current_column, next_row, next_column,
+                                 current_piece, placed_piece, captured_piece, sign: int) -> None:
+        """Adds a move to the running totals with sign 1, or takes it back out with sign -1"""
+        color = current_piece[2]
+        start = current_row * 8 + current_column
+        end = next_row * 8 + next_column
+        self.material_totals[color] += sign * (placed_piece[1] - current_piece[1])
+        self.square_score_totals[color] += sign * (SQUARE_SCORES[(placed_piece[0], color)][end]
+                                                   - SQUARE_SCORES[(current_piece[0], color)][start])
+        if captured_piece != self.none_piece:
+            self.material_totals[1 - color] -= sign * captured_piece[1]
+            self.square_score_totals[1 - color] -= sign * SQUARE_SCORES[(captured_piece[0], 1 - color)][end]
+
+    def unmake_move(self) -> tuple:
+        """Takes back the last move played with make_move and returns it"""
+        (current_row, current_column, next_row, next_column, current_piece,
+         captured_piece, promotion, turn, current_turn, zobrist_key) = self.undo_stack.pop()
+        self.clear_caches()
+
+        self.game_board[current_row][current_column] = current_piece
+        self.game_board[next_row][next_column] = captured_piece
+
+        color = current_piece[2]
+        self.piece_squares[color].remove((next_row, next_column))
+        self.piece_squares[color].add((current_row, current_column))
+        if captured_piece != self.none_piece:
+            self.piece_squares[1 - color].add((next_row, next_column))
+        if current_piece[0] == self.king_sign:
+            self.king_squares[color] = (current_row, current_column)
+        placed_piece = promotion if promotion is not None else current_piece
+        self.update_evaluation_totals(current_row, current_column, next_row, next_column,
+                                      current_piece, placed_piece, captured_piece, -1)
+        self.turn = turn
+        self.current_turn = current_turn
+        self.zobrist_key = zobrist_key
+        if self.debug_evaluation:
+            self.check_evaluation_totals()
+        return (current_row, current_column, next_row, next_column)
+
+    def played_moves(self, start: int = 0) -> list:
+        """
+        The moves on undo_stack from index start on, as (row, column, row, column).
+        The undo records differ between board backends, this is the same for all of them.
+        """
+        return [record[:4] for record in self.undo_stack[start:]]
+
+def move_to_text(move) -> str:
+    """(row, column, row, column) as coordinates like e2e4, the format main.parse_move reads"""
+    current_row, current_column, next_row, next_column = move
+    files = "abcdefgh"
+    return f"{files[current_column]}{current_row + 1}{files[next_column]}{next_row + 1}"
+
+
+def iter_fen_file(path: str, board=None):
+    """
+    Yields one board per FEN or EPD line of path, reading a line at a time.
+    Blank lines and lines starting with # are skipped. When board is given that one board is
+    reloaded for every line, so memory stays constant however many positions the file holds.
+    """
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            position = board if board is not None else BoardHumanVHuman()
+            position.from_fen(line)
+            yield position
+
 
 class BoardHumanVRandom(BoardHumanVHuman):
     def move(self):
@@ -752,177 +1152,688 @@ class BoardHumanVRandom(BoardHumanVHuman):
                     continue
                 break
 
-        current_piece = self.game_board[current_row][current_column]
+        self.make_move(current_row, current_column, next_row, next_column)
 
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
+class RandomVRandom(BoardHumanVHuman):
+    def move(self):
+        current_row, current_column, next_row, next_column = self.random_action()
+        self.make_move(current_row, current_column, next_row, next_column)
+        return (current_row, current_column, next_row, next_column)
 
-        self.game_board[current_row][current_column] = self.none_piece
-        self.game_board[next_row][next_column] = current_piece
 
+    def manual_move(self, current_row, current_column, next_row, next_column):
+        self.make_move(current_row, current_column, next_row, next_column)
 
-        self.change_turn()
-        self.current_turn += 1
 
-class RandomVRandom(BoardHumanVHuman):
-    def move(self):
-        current_row, current_column, next_row, next_column = self.random_action()
-        current_piece = self.game_board[current_row][current_column]
+class UCTNode():
+    __slots__ = ("move", "parent", "children", "untried_moves", "visits", "value", "player", "key", "mate")
 
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
+    def __init__(self, move, parent, player, key):
+        self.move = move
+        self.parent = parent
+        self.children = {}
+        # Filled with the legal moves the first time the node is reached
+        self.untried_moves = None
+        self.visits = 0
+        # Sum of rollout results seen from the side of player, the colour that played move
+        self.value = 0.0
+        self.player = player
+        self.key = key
+        self.mate = False
 
-        self.game_board[current_row][current_column] = self.none_piece
-        self.game_board[next_row][next_column] = current_piece
-        self.change_turn()
-        self.current_turn += 1
-        return (current_row, current_column, next_row, next_column)
 
+# Board each pool worker reuses for its rollouts, created by _init_rollout_worker
+_worker_board = None
+# multiprocessing.Event shared with the parent that stops root parallel searches in the workers
+_worker_stop = None
 
-    def manual_move(self, current_row, current_column, next_row, next_column):
 
-        current_piece = self.game_board[current_row][current_column]
+def _init_rollout_worker(tt_mb, stop_event=None):
+    global _worker_board, _worker_stop
+    _worker_board = AIVMCTS(depth=0, width=0, tt_mb=tt_mb)
+    _worker_stop = stop_event
 
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
 
-        self.game_board[next_row][next_column] = current_piece
-        self.game_board[current_row][current_column] = self.none_piece
-        self.change_turn() 
-        self.current_turn +=1 
+def rollout_worker(task) -> float:
+    """Runs one rollout in a pool worker. task is (compact position, depth, seed)."""
+    compact, depth, seed = task
+    _worker_board.from_compact(compact)
+    _worker_board.depth = depth
+    random.seed(seed)
+    return _worker_board.rollout()
+
+
+def root_parallel_worker(task, stop_event=None) -> dict:
+    """
+    Grows one independent tree in a pool worker and returns its root children as
+    {move: (visits, value, mate)}. task is (compact position, settings, seed, iterations, time_limit_ms).
+    The search ends early when stop_event, or in a pool worker the pool's stop event, is set.
+    """
+    compact, settings, seed, iterations, time_limit_ms = task
+    engine = AIVMCTS(seed=seed, **settings)
+    engine.stop_event = stop_event if stop_event is not None else _worker_stop
+    engine.from_compact(compact)
+    root = engine.reuse_tree()
+    engine.search(root, iterations, time_limit_ms)
+    return {move: (child.visits, child.value, child.mate) for move, child in root.children.items()}
+
+
+# Milliseconds allocate_move_time keeps back for playing the move after the search
+CLOCK_MARGIN_MS = 10
 
 
 class AIVMCTS(BoardHumanVHuman):
-    def __init__(self, depth, width):
-        """Monte Carlo Tree Search in this version is always for black"""
+    def __init__(self, depth, width, tt_mb=16, tt_policy="depth", exploration=1.4,
+                 workers=0, batch_size=None, seed=None, root_parallel=False, time_limit_ms=None,
+                 batched_rollouts=False):
+        """
+        Monte Carlo Tree Search (UCT) for whichever side is to move.
+        width is the number of iterations per move and depth the number of full moves per rollout.
+        With time_limit_ms every move searches for that long instead of width iterations.
+        With workers > 0 the rollouts run in a process pool that is kept between moves.
+        Leaves are collected batch_size at a time before their rollouts run, and every rollout
+        gets its own seed, so a given seed and batch_size give the same moves with or without workers.
+        With root_parallel every worker instead grows its own tree of width iterations from the root
+        and the root statistics of all trees are added up to pick the move. Setting stop_event stops
+        the workers' trees too, but nothing is kept between moves, so ponder() does nothing then.
+        With batched_rollouts (and no workers) the rollouts of a batch are played together in NumPy
+        by batch.py, which pays off with a batch_size in the hundreds.
+        """
         super().__init__()
         self.depth = depth
         self.width = width
+        self.exploration = exploration
+        self.workers = workers
+        self.batch_size = batch_size if batch_size is not None else max(1, 4 * workers)
+        self.seed = seed
+        self.root_parallel = root_parallel
+        self.time_limit_ms = time_limit_ms
+        self.batched_rollouts = batched_rollouts
+        # Random numbers of the tree itself (expansion order and rollout seeds)
+        self.rng = random.Random(seed)
+        self.pool = None
+        # Tells the pool workers to stop a root parallel search, passed to them when the pool starts
+        self.pool_stop = None
+        # Summed {move: [visits, value, mate]} of the last root parallel search
+        self.root_statistics = {}
+        # Rollout statistics and legal move lists by position key, kept between turns
+        self.tt = TranspositionTable(max_mb=tt_mb, policy=tt_policy)
+        # Search tree kept between moves, root_history_length is len(undo_stack) at the root
+        self.root = None
+        self.root_history_length = 0
+        # Set from another thread (a threading.Event) to stop the search early, the best move so far is played
+        self.stop_event = None
+
+    def generate_moves(self) -> list:
+        # Positions seen before reuse their legal move list from the transposition table
+        entry = self.tt.probe(self.zobrist_key)
+        if entry is not None and entry.moves is not None:
+            return entry.move_list()
+        moves = super().generate_moves()
+        self.tt.store_moves(self.zobrist_key, moves)
+        return moves
 
     def get_score(self) -> int:
-        score = 0
+        # Black's material when White is to move, read from the running totals
         if self.turn == "white":
-            for row in range(8):
-                for column in range(8):
-                    if self.game_board[row][column][2] == self.black:
-                        score += self.game_board[row][column][1]
-        return score
+            return self.material_totals[self.black]
+        return 0
 
     def random_move(self):
         current_row, current_column, next_row, next_column = self.random_action()
-        current_piece = self.game_board[current_row][current_column]
-
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
-
-        self.game_board[current_row][current_column] = self.none_piece
-        self.game_board[next_row][next_column] = current_piece
-        self.change_turn()
-        self.current_turn += 1
+        self.make_move(current_row, current_column, next_row, next_column)
 
     def manual_move(self, current_row, current_column, next_row, next_column):
+        self.make_move(current_row, current_column, next_row, next_column)
+
+    def move(self, time_limit_ms=None, remaining_ms=None, increment_ms=0):
+        # Plays the engine's move and returns it, like RandomVRandom.move. With remaining_ms, the time
+        # left on the mover's clock, the move gets its share of the clock from allocate_move_time.
+        if time_limit_ms is None and remaining_ms is not None:
+            time_limit_ms = self.allocate_move_time(remaining_ms, increment_ms)
+        current_row, current_column, next_row, next_column = self.MCTS(time_limit_ms)
+        self.make_move(current_row, current_column, next_row, next_column)
+        return (current_row, current_column, next_row, next_column)
 
-        current_piece = self.game_board[current_row][current_column]
+    def result_for_white(self) -> float:
+        """1 for a white win, 0 for a black win and 0.5 for a draw. Unfinished games are scored on material."""
+        if not self.has_legal_move():
+            if self.turn == "white" and self.is_white_check():
+                return 0.0
+            if self.turn == "black" and self.is_black_check():
+                return 1.0
+            return 0.5
+        if self.current_turn >= self.max_turn:
+            return 0.5
 
-        # Promoting pawn
-        # White
-        if (current_piece == self.white_pawn and next_row == 7):
-            current_piece = self.white_queen
-        # Black
-        elif (current_piece == self.black_pawn and next_row == 0):
-            current_piece = self.black_queen
+        white_material = self.material(self.white)
+        black_material = self.material(self.black)
+        return 0.5 + 0.5 * (white_material - black_material) / (white_material + black_material)
 
-        self.game_board[next_row][next_column] = current_piece
-        self.game_board[current_row][current_column] = self.none_piece
-        self.change_turn() 
-        self.current_turn +=1 
-
-    def MCTS(self) -> tuple:
-        # Works for both colours
-        best_score_init = -999999
-        best_move = -9999
-        best_score = best_score_init
-
-        for _ in range(self.width):
-            # Reseting the game after each width
-            MCTS_game = copy.deepcopy(self)
-
-            # Monte Carlo Tree Seach black
-            base_action = MCTS_game.random_action()
-            MCTS_game.manual_move(base_action[0], base_action[1], base_action[2], base_action[3])
-
-            # Checking if first move leads to checkmate
-            if MCTS_game.is_checkmate():
-                return base_action
-            # Checking if no move is avaliable (Draw)
-            if len(MCTS_game.action_space()) == 0:
-                continue
-            
-            # Now white random move
-            MCTS_game.random_move()
+    def material(self, color: int) -> int:
+        return self.material_totals[color]
 
-            # Checks if this leads to black checkmate
-            if MCTS_game.is_checkmate():
-                continue
-            # Checking if no move is avaliable (Draw)
-            if len(MCTS_game.action_space()) == 0:
-                continue
+    def rollout(self) -> float:
+        """Plays random moves for depth full moves from the current position and returns result_for_white"""
+        for _ in range(2 * self.depth):
+            if self.current_turn >= self.max_turn:
+                break
+            # One pass over the moves instead of building the list to check it is not empty
+            move = self.sample_legal_move()
+            if move is None:
+                break
+            self.make_move(*move)
+        return self.result_for_white()
+
+    def reuse_tree(self) -> UCTNode:
+        """Returns the root for this search, walking the old tree down the moves played since the last one"""
+        node = self.root
+        if node is not None and self.root_history_length <= len(self.undo_stack):
+            for move in self.played_moves(self.root_history_length):
+                node = node.children.get(move)
+                if node is None:
+                    break
+        if node is None or node.key != self.zobrist_key:
+            mover = self.black if self.turn == "white" else self.white
+            node = UCTNode(move=None, parent=None, player=mover, key=self.zobrist_key)
+        node.parent = None
+        self.root = node
+        self.root_history_length = len(self.undo_stack)
+        return node
+
+    def select_child(self, node: UCTNode) -> UCTNode:
+        log_visits = math.log(max(node.visits, 1))
+        return max(node.children.values(),
+                   key=lambda child: (child.value / child.visits
+                                      + self.exploration * math.sqrt(log_visits / child.visits)))
+
+    def new_child(self, node: UCTNode, move) -> UCTNode:
+        """Adds the child for move, which must already be played on the board"""
+        child = UCTNode(move=move, parent=node, player=1 - node.player, key=self.zobrist_key)
+        # A position reached through another move order starts from its statistics
+        entry = self.tt.probe(child.key)
+        if entry is not None and entry.visits > 0:
+            child.visits = entry.visits
+            child.value = entry.score
+        child.mate = self.is_checkmate()
+        node.children[move] = child
+        return child
+
+    def backpropagate(self, node: UCTNode, result_for_white: float, depth: int) -> None:
+        while node is not None:
+            reward = result_for_white if node.player == self.white else 1 - result_for_white
+            node.visits += 1
+            node.value += reward
+            entry = self.tt.store(node.key, depth=depth)
+            if entry is not None:
+                entry.visits += 1
+                entry.score += reward
+            node = node.parent
+            depth += 1
+
+    def descend(self, root: UCTNode) -> UCTNode:
+        """Selection and expansion from root. The moves down to the returned node are left on the board."""
+        node = root
+        # Selection
+        while node.untried_moves is not None and len(node.untried_moves) == 0 and node.children:
+            node = self.select_child(node)
+            self.make_move(*node.move)
+
+        # Expansion
+        if node.untried_moves is None:
+            node.untried_moves = self.action_space()
+        if node.untried_moves:
+            move = node.untried_moves.pop(self.rng.randint(0, len(node.untried_moves) - 1))
+            self.make_move(*move)
+            node = self.new_child(node, move)
+        return node
+
+    def add_virtual_loss(self, node: UCTNode, amount: int) -> None:
+        # Visits without value make the path look worse so the rest of a batch spreads out
+        while node is not None:
+            node.visits += amount
+            node = node.parent
+
+    def seeded_rollout(self, seed: int) -> float:
+        """Rollout from the current position with its own seed, the caller's random state is kept"""
+        state = random.getstate()
+        random.seed(seed)
+        try:
+            return self.rollout()
+        finally:
+            random.setstate(state)
+
+    def get_pool(self):
+        if self.pool is None:
+            # An Event can only reach a process when it starts, so it is handed over in initargs
+            self.pool_stop = multiprocessing.Event()
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_rollout_worker,
+                                            initargs=(self.tt.max_mb, self.pool_stop))
+        return self.pool
+
+    def close(self) -> None:
+        """Shuts down the rollout workers"""
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def __getstate__(self):
+        # The worker pool belongs to this process and is not copied or pickled
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["pool_stop"] = None
+        state["stop_event"] = None
+        return state
+
+    def run_batch(self, root: UCTNode, count: int) -> None:
+        """Picks count leaves, rolls them all out (in the pool when there are workers) and backpropagates"""
+        leaves = []
+        tasks = []
+        results = []
+        for _ in range(count):
+            history_length = len(self.undo_stack)
+            try:
+                node = self.descend(root)
+                self.add_virtual_loss(node, 1)
+                seed = self.rng.getrandbits(32)
+                if self.workers:
+                    tasks.append((self.to_compact(), self.depth, seed))
+                elif self.batched_rollouts:
+                    tasks.append(self.to_compact())
+                else:
+                    results.append(self.seeded_rollout(seed))
+            finally:
+                while len(self.undo_stack) > history_length:
+                    self.unmake_move()
+            leaves.append(node)
+
+        if self.workers:
+            chunksize = max(1, len(tasks) // (4 * self.workers))
+            results = list(self.get_pool().map(rollout_worker, tasks, chunksize=chunksize))
+        elif self.batched_rollouts:
+            # Imported here so numpy is only needed when batched rollouts are asked for
+            import batch
+            results = batch.rollout_results(tasks, 2 * self.depth, seed=self.rng.getrandbits(32),
+                                            max_turn=self.max_turn)
+
+        # Backpropagation, depth is counted up from the leaf so entries near the root win slot conflicts
+        for node, result in zip(leaves, results):
+            self.add_virtual_loss(node, -1)
+            self.backpropagate(node, result, depth=0)
+
+    def best_root_move(self, root: UCTNode):
+        # A move that mates right away is always taken, otherwise the most visited one
+        for move, child in root.children.items():
+            if child.mate:
+                return move
+        return max(root.children.items(), key=lambda item: item[1].visits)[0]
+
+    def is_stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def search(self, root: UCTNode, iterations, time_limit_ms=None, early_stop=False) -> int:
+        """
+        Grows the tree under root for iterations (None for no limit), or until time_limit_ms runs out
+        or stop_event is set. With early_stop it also ends once the best root move is settled.
+        Returns iterations done.
+        """
+        start = time.perf_counter()
+        deadline = None if time_limit_ms is None else start + time_limit_ms / 1000
+        done = 0
+        while ((iterations is None or done < iterations) and (deadline is None or time.perf_counter() < deadline)
+               and not self.is_stopped()):
+            count = self.batch_size if iterations is None else min(self.batch_size, iterations - done)
+            self.run_batch(root, count)
+            done += count
+            if early_stop:
+                remaining = None if iterations is None else iterations - done
+                if deadline is not None:
+                    # Iterations that still fit before the deadline at the speed so far
+                    now = time.perf_counter()
+                    expected = int(done * (deadline - now) / max(now - start, 1e-9))
+                    remaining = expected if remaining is None else min(remaining, expected)
+                if remaining is not None and self.is_decided(root, remaining):
+                    break
+        return done
 
-            for _ in range(self.depth):
-                # Monte Carlo Tree Search black again
-                MCTS_game.random_move()
+    def is_decided(self, root: UCTNode, remaining: int) -> bool:
+        """True when remaining more iterations cannot change the move best_root_move picks"""
+        if any(child.mate for child in root.children.values()):
+            return True
+        if root.untried_moves == [] and len(root.children) <= 1:
+            return True
+        visits = sorted((child.visits for child in root.children.values()), reverse=True)
+        if not visits:
+            return False
+        # Even if every remaining iteration went to the runner-up (or a move not tried yet) it stays behind
+        runner_up = visits[1] if len(visits) > 1 else 0
+        return visits[0] > runner_up + remaining
 
-                if MCTS_game.is_checkmate():
-                    return base_action
-                # Checking if no move is avaliable (Draw)
-                if len(MCTS_game.action_space()) == 0:
-                    continue
+    def allocate_move_time(self, remaining_ms: float, increment_ms: float = 0, moves_to_go=None) -> int:
+        """
+        Milliseconds to think about this move when remaining_ms are left on the clock and increment_ms
+        are added after every move. Without moves_to_go the game is expected to go on until max_turn,
+        counting at most 40 more own moves.
+        """
+        if moves_to_go is None:
+            own_moves_left = (self.max_turn - self.current_turn + 1) // 2
+            moves_to_go = min(40, own_moves_left)
+        moves_to_go = max(1, moves_to_go)
+        budget = remaining_ms / moves_to_go + 0.8 * increment_ms
+        # Never more than half the clock, and a margin for playing the move once it is found
+        budget = min(budget, remaining_ms / 2) - CLOCK_MARGIN_MS
+        return max(1, int(budget))
+
+    def ponder(self, stop_event, iterations=None) -> int:
+        """
+        Searches the current position, normally on the opponent's turn, until stop_event is set
+        or iterations are done. The tree is kept, so after the opponent's move MCTS() carries on
+        from the subtree of that move and the rest is dropped. Returns iterations done.
+        """
+        # Root parallel search starts from scratch every move, so there is nothing to keep
+        if self.root_parallel or self.game_status() is not None:
+            return 0
+        self.tt.new_search()
+        root = self.reuse_tree()
+        done = 0
+        while not stop_event.is_set() and not self.is_stopped() and (iterations is None or done < iterations):
+            count = self.batch_size if iterations is None else min(self.batch_size, iterations - done)
+            done += self.search(root, count)
+        return done
+
+    def MCTS_root_parallel(self, time_limit_ms=None) -> tuple:
+        """One independent tree per worker from the current position, merged at the root"""
+        settings = {"depth": self.depth, "width": self.width, "tt_mb": self.tt.max_mb,
+                    "tt_policy": self.tt.policy, "exploration": self.exploration}
+        compact = self.to_compact()
+        iterations = self.width if time_limit_ms is None else None
+        tasks = [(compact, settings, self.rng.getrandbits(32), iterations, time_limit_ms)
+                 for _ in range(max(1, self.workers))]
+        if self.workers:
+            pool = self.get_pool()
+            self.pool_stop.clear()
+            futures = [pool.submit(root_parallel_worker, task) for task in tasks]
+            pending = futures
+            while pending:
+                # stop_event can't be seen by the workers, so it is passed on to the pool's event,
+                # after which they return the trees grown so far
+                _, pending = wait(pending, timeout=0.05)
+                if self.is_stopped():
+                    self.pool_stop.set()
+            trees = [future.result() for future in futures]
+        else:
+            trees = [root_parallel_worker(task, self.stop_event) for task in tasks]
+
+        merged = {}
+        for tree in trees:
+            for move, (visits, value, mate) in tree.items():
+                total = merged.setdefault(move, [0, 0.0, False])
+                total[0] += visits
+                total[1] += value
+                total[2] = total[2] or mate
+        self.root_statistics = merged
+
+        if not merged:
+            return self.random_action()
+        for move, (visits, value, mate) in merged.items():
+            if mate:
+                return move
+        return max(merged.items(), key=lambda item: item[1][0])[0]
 
-                # White random move
-                MCTS_game.random_move()
+    def MCTS(self, time_limit_ms=None) -> tuple:
+        """
+        Best move for the side to move, works for both colours. With a time limit (this call's or
+        the engine's time_limit_ms) it searches until then and plays the best move found so far,
+        otherwise it runs width iterations. Either way it stops early once the move is settled.
+        """
+        if time_limit_ms is None:
+            time_limit_ms = self.time_limit_ms
+        if self.root_parallel:
+            return self.MCTS_root_parallel(time_limit_ms)
+
+        self.tt.new_search()
+        root = self.reuse_tree()
+        iterations = self.width if time_limit_ms is None else None
+        self.search(root, iterations, time_limit_ms, early_stop=True)
+
+        # No legal move from the root
+        if not root.children:
+            return self.random_action()
+        return self.best_root_move(root)
 
-                if MCTS_game.is_checkmate():
-                    break
-                # Checking if no move is avaliable (Draw)
-                if len(MCTS_game.action_space()) == 0:
-                    continue
 
+MATE_SCORE = 100000
+INFINITE_SCORE = 1000000
 
-            score = MCTS_game.get_score()
-            if score > best_score:
-                best_score = score
-                best_move = base_action
 
-        # if all depths and widths leads to checkmate
-        if best_score == best_score_init:
-            return self.random_action()
-        return best_move
+class SearchAborted(Exception):
+    """Raised inside AIVAlphaBeta's search when the time runs out or stop_event is set"""
 
 
-        
+class AIVAlphaBeta(BoardHumanVHuman):
+    def __init__(self, depth=4, time_limit_ms=None, quiescence=True):
+        """
+        Negamax alpha-beta for whichever side is to move, deepening one ply at a time up to depth.
+        With time_limit_ms the deepening stops when time runs out and the move of the deepest
+        finished iteration is played. Captures are searched on past depth when quiescence is on.
+        """
+        super().__init__()
+        self.depth = depth
+        self.time_limit_ms = time_limit_ms
+        self.quiescence = quiescence
+        # Set from another thread (a threading.Event) to stop the search early, like AIVMCTS
+        self.stop_event = None
+        # Quiet moves that caused a cutoff, two per ply, and cutoff counts by from * 64 + to square
+        self.killers = []
+        self.history = [0] * 4096
+        # Principal variation of the last finished iteration, searched first by the next one
+        self.previous_pv = []
+        self.deadline = None
+        self.nodes = 0
+        # Best (score, line) at the root of the iteration running now
+        self.root_best = None
+        # Depth, score, nodes, time and nodes per second of the last search
+        self.search_info = {}
 
+    def manual_move(self, current_row, current_column, next_row, next_column):
+        self.make_move(current_row, current_column, next_row, next_column)
 
+    def move(self, time_limit_ms=None):
+        # Plays the engine's move and returns it, like AIVMCTS.move
+        current_row, current_column, next_row, next_column = self.alpha_beta(time_limit_ms)
+        self.make_move(current_row, current_column, next_row, next_column)
+        return (current_row, current_column, next_row, next_column)
 
+    def evaluate(self) -> int:
+        """Material and piece-square balance in centipawns for the side to move, from the running totals"""
+        score = self.square_score_totals[self.white] - self.square_score_totals[self.black]
+        return score if self.turn == "white" else -score
+
+    def in_check(self) -> bool:
+        return self.is_king_attacked(self.white if self.turn == "white" else self.black)
+
+    def capture_moves(self) -> list:
+        """Legal captures and promotions of the side to move, without working out the quiet moves"""
+        color = self.white if self.turn == "white" else self.black
+        last_row = 7 if color == self.white else 0
+        moves = []
+        for row, column in sorted(self.piece_squares[color]):
+            is_pawn = self.game_board[row][column][0] == self.pawn_sign
+            for next_row, next_column in self.candidate_targets(row, column):
+                target = self.game_board[next_row][next_column]
+                if target[2] == 1 - color or (is_pawn and next_row == last_row):
+                    if self.is_move_valid(row, column, next_row, next_column):
+                        moves.append((row, column, next_row, next_column))
+        return moves
+
+    def capture_order(self, move) -> int:
+        """MVV-LVA: the most valuable victim first, the cheapest attacker first among equal victims"""
+        attacker = self.game_board[move[0]][move[1]]
+        victim = self.game_board[move[2]][move[3]]
+        score = 10 * PIECE_SCORES[victim[0]] - PIECE_SCORES[attacker[0]] if victim != self.none_piece else 0
+        # Promotions are ordered like winning a queen for the pawn
+        if attacker[0] == self.pawn_sign and move[2] in (0, 7):
+            score += 10 * (PIECE_SCORES['q'] - PIECE_SCORES['p'])
+        return score
 
-       
+    def order_moves(self, moves: list, ply: int, pv_move) -> list:
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        scored = []
+        for move in moves:
+            if move == pv_move:
+                order = 4 * INFINITE_SCORE
+            else:
+                capture = self.capture_order(move)
+                if capture > 0:
+                    order = 2 * INFINITE_SCORE + capture
+                elif move in killers:
+                    order = INFINITE_SCORE + (1 if move == killers[0] else 0)
+                else:
+                    order = self.history[(move[0] * 8 + move[1]) * 64 + move[2] * 8 + move[3]]
+            scored.append((order, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for order, move in scored]
+
+    def check_time(self) -> None:
+        # Called every 16 nodes, a few ms at the few thousand nodes per second this engine searches
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def store_cutoff(self, move, depth: int, ply: int) -> None:
+        """Remembers a quiet move that refuted the position as a killer and in the history table"""
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+        self.history[(move[0] * 8 + move[1]) * 64 + move[2] * 8 + move[3]] += depth * depth
+
+    def quiescence_search(self, alpha: int, beta: int, ply: int) -> int:
+        """
+        Searches captures and promotions only, until the position is quiet. In check there is
+        no standing pat and every evasion is searched, so mates are scored as mates.
+        """
+        self.nodes += 1
+        if self.nodes & 15 == 0:
+            self.check_time()
+        in_check = self.in_check()
+        if in_check:
+            moves = self.action_space()
+            if not moves:
+                return -MATE_SCORE + ply
+        if self.current_turn >= self.max_turn:
+            return 0
 
+        if in_check:
+            best = -INFINITE_SCORE
+        else:
+            # Standing pat: the side to move does not have to capture
+            best = self.evaluate()
+            if best >= beta:
+                return best
+            alpha = max(alpha, best)
+            moves = self.capture_moves()
+
+        # Sorted on the capture order alone, the sort keeps the rest in generation order
+        moves.sort(key=self.capture_order, reverse=True)
+        for move in moves:
+            self.make_move(*move)
+            score = -self.quiescence_search(-beta, -alpha, ply + 1)
+            self.unmake_move()
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def negamax(self, depth: int, alpha: int, beta: int, ply: int, on_pv: bool) -> tuple:
+        """Returns (score for the side to move, principal variation from here)"""
+        self.nodes += 1
+        if self.nodes & 15 == 0:
+            self.check_time()
+        moves = self.action_space()
+        if not moves:
+            return (-MATE_SCORE + ply if self.in_check() else 0), []
+        if self.current_turn >= self.max_turn:
+            return 0, []
+        if depth <= 0:
+            if self.quiescence:
+                return self.quiescence_search(alpha, beta, ply), []
+            return self.evaluate(), []
+
+        pv_move = self.previous_pv[ply] if on_pv and ply < len(self.previous_pv) else None
+        best = -INFINITE_SCORE
+        best_line = []
+        for move in self.order_moves(moves, ply, pv_move):
+            self.make_move(*move)
+            score, line = self.negamax(depth - 1, -beta, -alpha, ply + 1, on_pv and move == pv_move)
+            score = -score
+            self.unmake_move()
+            if score > best:
+                best = score
+                best_line = [move] + line
+                if ply == 0:
+                    # Kept for when the iteration is cut off before it finishes
+                    self.root_best = (best, best_line)
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if self.capture_order(move) == 0:
+                            self.store_cutoff(move, depth, ply)
+                        break
+        return best, best_line
+
+    def alpha_beta(self, time_limit_ms=None) -> tuple:
+        """
+        Best move for the side to move by iterative deepening. search_info holds the depth reached,
+        score, principal variation, nodes and nodes per second afterwards.
+        """
+        if time_limit_ms is None:
+            time_limit_ms = self.time_limit_ms
+        start = time.perf_counter()
+        deadline = None if time_limit_ms is None else start + time_limit_ms / 1000
+        # Depth 1 always finishes (unless stop_event is set), so there is a searched move to play
+        self.deadline = None
+        self.nodes = 0
+        self.killers = []
+        self.history = [0] * 4096
+        self.previous_pv = []
+        history_length = len(self.undo_stack)
+
+        moves = self.action_space()
+        if not moves:
+            return self.random_action()
+        best_move = moves[0]
+        best_score = 0
+        reached = 0
+        for depth in range(1, self.depth + 1):
+            self.root_best = None
+            try:
+                score, line = self.negamax(depth, -INFINITE_SCORE, INFINITE_SCORE, 0, True)
+            except SearchAborted:
+                while len(self.undo_stack) > history_length:
+                    self.unmake_move()
+                # The previous best move is searched first, so a move that beat it in the
+                # unfinished iteration is the better choice
+                if self.root_best is not None:
+                    best_score, line = self.root_best
+                    best_move = line[0]
+                break
+            finally:
+                self.deadline = deadline
+            best_move, best_score, reached = line[0], score, depth
+            self.previous_pv = line
+            # A forced mate will not get any shorter by searching deeper
+            if abs(score) > MATE_SCORE - 1000:
+                break
+
+        elapsed = time.perf_counter() - start
+        self.search_info = {"depth": reached, "score": best_score, "pv": list(self.previous_pv),
+                            "nodes": self.nodes, "time_ms": 1000 * elapsed,
+                            "nps": self.nodes / elapsed if elapsed > 0 else 0.0}
+        return best_move
@@ -0,0 +1,84 @@
+"""
+Piece values and piece-square tables for the engines' evaluation. BoardHumanVHuman keeps the sum
+of SQUARE_SCORES per side up to date in make_move/unmake_move, so evaluating a position is a lookup.
+"""
+
+# Centipawn piece values. The game's own piece values (queen 1) are kept for get_score and the
+# MCTS material count.
+PIECE_SCORES = {'p': 100, 'kn': 320, 'b': 330, 'r': 500, 'q': 900, 'ki': 0}
+
+# Bonus per square from White's side, drawn as the board is seen by White: the first line is the
+# 8th rank, the last line the 1st rank
+PIECE_SQUARE_TABLES = {
+    'p': (
+        0,   0,   0,   0,   0,   0,   0,   0,
+        50,  50,  50,  50,  50,  50,  50,  50,
+        10,  10,  20,  30,  30,  20,  10,  10,
+        5,   5,  10,  25,  25,  10,   5,   5,
+        0,   0,   0,  20,  20,   0,   0,   0,
+        5,  -5, -10,   0,   0, -10,  -5,   5,
+        5,  10,  10, -20, -20,  10,  10,   5,
+        0,   0,   0,   0,   0,   0,   0,   0),
+    'kn': (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20,   0,   0,   0,   0, -20, -40,
+        -30,   0,  10,  15,  15,  10,   0, -30,
+        -30,   5,  15,  20,  20,  15,   5, -30,
+        -30,   0,  15,  20,  20,  15,   0, -30,
+        -30,   5,  10,  15,  15,  10,   5, -30,
+        -40, -20,   0,   5,   5,   0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50),
+    'b': (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,  10,  10,   5,   0, -10,
+        -10,   5,   5,  10,  10,   5,   5, -10,
+        -10,   0,  10,  10,  10,  10,   0, -10,
+        -10,  10,  10,  10,  10,  10,  10, -10,
+        -10,   5,   0,   0,   0,   0,   5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20),
+    'r': (
+        0,   0,   0,   0,   0,   0,   0,   0,
+        5,  10,  10,  10,  10,  10,  10,   5,
+        -5,   0,   0,   0,   0,   0,   0,  -5,
+        -5,   0,   0,   0,   0,   0,   0,  -5,
+        -5,   0,   0,   0,   0,   0,   0,  -5,
+        -5,   0,   0,   0,   0,   0,   0,  -5,
+        -5,   0,   0,   0,   0,   0,   0,  -5,
+        0,   0,   0,   5,   5,   0,   0,   0),
+    'q': (
+        -20, -10, -10,  -5,  -5, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+        -5,   0,   5,   5,   5,   5,   0,  -5,
+        0,   0,   5,   5,   5,   5,   0,  -5,
+        -10,   5,   5,   5,   5,   5,   0, -10,
+        -10,   0,   5,   0,   0,   0,   0, -10,
+        -20, -10, -10,  -5,  -5, -10, -10, -20),
+    # There is no castling, so the king is only kept off the open centre
+    'ki': (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20,  20,   0,   0,   0,   0,  20,  20,
+        20,  30,  10,   0,   0,  10,  30,  20),
+}
+
+
+def _square_scores(sign: str, color: int) -> list:
+    """Piece value plus table bonus for every square (row * 8 + column) of a piece of color"""
+    table = PIECE_SQUARE_TABLES[sign]
+    scores = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        # White's 1st rank is the table's last line, Black sees the board mirrored
+        line = 7 - row if color == 0 else row
+        scores.append(PIECE_SCORES[sign] + table[line * 8 + column])
+    return scores
+
+
+# SQUARE_SCORES[(sign, color)][square], in the same layout as chess.ZOBRIST_PIECES
+SQUARE_SCORES = {(sign, color): _square_scores(sign, color) for sign in PIECE_SCORES for color in (0, 1)}
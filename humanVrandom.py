@@ -11,21 +11,20 @@ number_of_games = 1
 
 for i in range(number_of_games):
     while True:
+        status = board.game_status()
         # Checking for checkmate
-        if board.turn == 'white':
-            if board.is_checkmate():
+        if status == "checkmate":
+            if board.turn == 'white':
                 print("Black Won")
-                break
-        else:
-            if board.is_checkmate():
+            else:
                 print("White Won")
-                break
-        if len(board.action_space()) == 0:
+            break
+        if status == "stalemate":
             print("Draw, nobody can move")
             break
 
         # Checking number of turns 
-        if board.current_turn == board.max_turn:
+        if status == "max_turn":
             print("Draw, max turns reached")
             break
 
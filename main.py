@@ -1,5 +1,7 @@
 import pygame
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import chess
 
 # --- Configuration ---
@@ -10,6 +12,14 @@ HEIGHT = BOARD_SIZE + (2 * MARGIN) + 100
 SQ_SIZE = BOARD_SIZE // 8
 FPS = 60
 
+# Engine playing Black: "random" for random moves, "mcts" for AIVMCTS with MCTS_SETTINGS
+# or "alphabeta" for AIVAlphaBeta with ALPHABETA_SETTINGS
+ENGINE = "random"
+MCTS_SETTINGS = {"depth": 3, "width": 200}
+ALPHABETA_SETTINGS = {"depth": 6, "time_limit_ms": 2000}
+# Let an engine that can ponder keep searching while White is typing a move
+PONDER = True
+
 # Colors
 WHITE_COLOR = (240, 217, 181)
 BLACK_COLOR = (181, 136, 99)
@@ -75,65 +85,169 @@ def load_images():
                 images[key] = s
     return images
 
-def draw_board_and_coordinates(screen, font):
-    pygame.draw.rect(screen, BORDER_COLOR, (0, 0, WIDTH, BOARD_SIZE + 2*MARGIN))
+def build_board_surface(font):
+    """Border, coordinates and empty squares, drawn once and copied from afterwards"""
+    surface = pygame.Surface((WIDTH, BOARD_SIZE + 2*MARGIN))
+    pygame.draw.rect(surface, BORDER_COLOR, (0, 0, WIDTH, BOARD_SIZE + 2*MARGIN))
     files = "ABCDEFGH"
     for col in range(8):
         x = MARGIN + (col * SQ_SIZE) + (SQ_SIZE // 2)
         y = MARGIN + BOARD_SIZE + 10
         label = font.render(files[col], True, COORD_COLOR)
-        screen.blit(label, label.get_rect(center=(x, y)))
+        surface.blit(label, label.get_rect(center=(x, y)))
     for row in range(8):
         rank_label = str(row + 1)
         x = MARGIN // 2
         y = MARGIN + ((7 - row) * SQ_SIZE) + (SQ_SIZE // 2)
         label = font.render(rank_label, True, COORD_COLOR)
-        screen.blit(label, label.get_rect(center=(x, y)))
+        surface.blit(label, label.get_rect(center=(x, y)))
     for row in range(8):
         for col in range(8):
-            color = WHITE_COLOR if (row + col) % 2 == 0 else BLACK_COLOR
-            x = MARGIN + (col * SQ_SIZE)
-            y = MARGIN + ((7 - row) * SQ_SIZE)
-            pygame.draw.rect(screen, color, (x, y, SQ_SIZE, SQ_SIZE))
+            pygame.draw.rect(surface, square_color(row, col), square_rect(row, col))
+    return surface
 
-def draw_pieces(screen, board, images):
-    for row in range(8):
-        for col in range(8):
-            piece = board.game_board[row][col]
-            if piece != board.none_piece:
-                sign, _, color_code = piece
-                color_name = "white" if color_code == 0 else "black"
-                piece_name = PIECE_NAMES.get(sign, "pawn")
-                image_key = f"{color_name}_{piece_name}"
-                if image_key in images:
-                    x = MARGIN + (col * SQ_SIZE)
-                    y = MARGIN + ((7 - row) * SQ_SIZE)
-                    screen.blit(images[image_key], (x, y))
-
-def draw_ui(screen, font, user_text, status_message, is_white_turn):
-    ui_y_start = BOARD_SIZE + (2 * MARGIN)
-    
-    pygame.draw.rect(screen, BG_COLOR, (0, ui_y_start, WIDTH, HEIGHT - ui_y_start))
-    
-    input_rect = pygame.Rect(MARGIN, ui_y_start + 10, WIDTH - (2*MARGIN), 40)
-    pygame.draw.rect(screen, INPUT_BOX_COLOR, input_rect)
-    
-    border_color = ACTIVE_BORDER_COLOR if is_white_turn else INACTIVE_BORDER_COLOR
-    pygame.draw.rect(screen, border_color, input_rect, 2)
-    
-    text_surface = font.render(user_text, True, TEXT_COLOR)
-    screen.blit(text_surface, (input_rect.x + 10, input_rect.y + 10))
-    
-    if is_white_turn:
-        if (pygame.time.get_ticks() // 500) % 2 == 0:
+def square_color(row, col):
+    return WHITE_COLOR if (row + col) % 2 == 0 else BLACK_COLOR
+
+def square_rect(row, col):
+    return pygame.Rect(MARGIN + (col * SQ_SIZE), MARGIN + ((7 - row) * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+
+class Renderer():
+    """
+    Draws the window by changes only. The board background is pre-rendered, a square is redrawn
+    only when its piece changed, and the text under the board only when the text or cursor changed.
+    draw() returns the rectangles to pass to pygame.display.update.
+    """
+    def __init__(self, screen, font, images):
+        self.screen = screen
+        self.font = font
+        self.images = images
+        self.board_surface = build_board_surface(font)
+        self.ui_rect = pygame.Rect(0, BOARD_SIZE + (2 * MARGIN), WIDTH, HEIGHT - BOARD_SIZE - (2 * MARGIN))
+        # Image per piece tuple, filled the first time a piece is drawn
+        self.piece_images = {}
+        # Text surfaces by string, only the ones currently shown are kept
+        self.text_surfaces = {}
+        self.invalidate()
+
+    def invalidate(self):
+        """Forgets what is on screen so the next draw repaints everything (start-up, window exposed)"""
+        # drawn[row][col] is the piece shown on that square
+        self.drawn = [[None] * 8 for _ in range(8)]
+        self.drawn_key = None
+        self.ui_state = None
+        self.full_redraw = True
+
+    def piece_image(self, piece):
+        image = self.piece_images.get(piece)
+        if image is None:
+            sign, _, color_code = piece
+            color_name = "white" if color_code == 0 else "black"
+            image = self.images.get(f"{color_name}_{PIECE_NAMES.get(sign, 'pawn')}")
+            self.piece_images[piece] = image
+        return image
+
+    def render_text(self, text, color):
+        surface = self.text_surfaces.get((text, color))
+        if surface is None:
+            surface = self.font.render(text, True, color)
+            self.text_surfaces[(text, color)] = surface
+        return surface
+
+    def draw_squares(self, board):
+        dirty = []
+        # Same key, same position, so nothing on the board can have changed
+        if board.zobrist_key == self.drawn_key:
+            return dirty
+        self.drawn_key = board.zobrist_key
+        for row in range(8):
+            for col in range(8):
+                piece = board.game_board[row][col]
+                if piece == self.drawn[row][col]:
+                    continue
+                self.drawn[row][col] = piece
+                rect = square_rect(row, col)
+                self.screen.blit(self.board_surface, rect, rect)
+                if piece != board.none_piece:
+                    image = self.piece_image(piece)
+                    if image is not None:
+                        self.screen.blit(image, rect)
+                dirty.append(rect)
+        return dirty
+
+    def draw_ui(self, user_text, status_message, is_white_turn):
+        cursor_visible = is_white_turn and (pygame.time.get_ticks() // 500) % 2 == 0
+        state = (user_text, status_message, is_white_turn, cursor_visible)
+        if state == self.ui_state:
+            return []
+        self.ui_state = state
+        # Keeps only the strings on screen now, the rest are re-rendered if they come back
+        self.text_surfaces = {key: surface for key, surface in self.text_surfaces.items()
+                              if key[0] in (user_text, status_message)}
+
+        ui_y_start = self.ui_rect.y
+        pygame.draw.rect(self.screen, BG_COLOR, self.ui_rect)
+
+        input_rect = pygame.Rect(MARGIN, ui_y_start + 10, WIDTH - (2*MARGIN), 40)
+        pygame.draw.rect(self.screen, INPUT_BOX_COLOR, input_rect)
+
+        border_color = ACTIVE_BORDER_COLOR if is_white_turn else INACTIVE_BORDER_COLOR
+        pygame.draw.rect(self.screen, border_color, input_rect, 2)
+
+        text_surface = self.render_text(user_text, TEXT_COLOR)
+        self.screen.blit(text_surface, (input_rect.x + 10, input_rect.y + 10))
+
+        if cursor_visible:
             text_width = text_surface.get_width()
             cursor_x = input_rect.x + 10 + text_width
             cursor_y_start = input_rect.y + 8
             cursor_y_end = input_rect.y + 32
-            pygame.draw.line(screen, TEXT_COLOR, (cursor_x, cursor_y_start), (cursor_x, cursor_y_end), 2)
+            pygame.draw.line(self.screen, TEXT_COLOR, (cursor_x, cursor_y_start), (cursor_x, cursor_y_end), 2)
 
-    status_surface = font.render(status_message, True, (200, 200, 200))
-    screen.blit(status_surface, (MARGIN, ui_y_start + 60))
+        status_surface = self.render_text(status_message, (200, 200, 200))
+        self.screen.blit(status_surface, (MARGIN, ui_y_start + 60))
+        return [self.ui_rect]
+
+    def draw(self, board, user_text, status_message, is_white_turn):
+        """Brings the screen up to date and returns the rectangles that changed"""
+        if self.full_redraw:
+            self.screen.fill(BG_COLOR)
+            self.screen.blit(self.board_surface, (0, 0))
+        dirty = self.draw_squares(board) + self.draw_ui(user_text, status_message, is_white_turn)
+        if self.full_redraw:
+            self.full_redraw = False
+            return [self.screen.get_rect()]
+        return dirty
+
+def make_engine():
+    """Separate board the engine thinks on, so the displayed board is never touched by the worker"""
+    if ENGINE == "mcts":
+        return chess.AIVMCTS(**MCTS_SETTINGS)
+    if ENGINE == "alphabeta":
+        return chess.AIVAlphaBeta(**ALPHABETA_SETTINGS)
+    if ENGINE == "random":
+        return chess.RandomVRandom()
+    raise ValueError(f"Unknown ENGINE {ENGINE!r}, use 'random', 'mcts' or 'alphabeta'")
+
+def sync_engine(engine, board):
+    """Takes back and plays moves on engine until it has the same move history as board"""
+    history = board.played_moves()
+    common = 0
+    for move in engine.played_moves():
+        if common >= len(history) or move != history[common]:
+            break
+        common += 1
+    while len(engine.undo_stack) > common:
+        engine.unmake_move()
+    for move in history[common:]:
+        engine.make_move(*move)
+
+def stop_pondering(future, ponder_stop):
+    """Stops pondering and waits for it, the engine must be idle before it is synced or searches"""
+    if future is not None:
+        ponder_stop.set()
+        wait([future])
+    return None
 
 def main():
     pygame.init()
@@ -145,10 +259,20 @@ def main():
     pygame.key.set_repeat(400, 50)
     
     images = load_images()
+    renderer = Renderer(screen, font, images)
     board = chess.BoardHumanVRandom()
+
+    # Black's moves are worked out in a background thread so the window keeps responding
+    engine = make_engine()
+    stop_event = threading.Event()
+    engine.stop_event = stop_event
+    executor = ThreadPoolExecutor(max_workers=1)
+    ai_future = None
+    ponder_stop = threading.Event()
+    ponder_future = None
     
     user_text = ''
-    status_message = "White to move. Input e.g., 'e2e4' or 'e2 e4'"
+    status_message = "White to move. Input e.g., 'e2e4' or 'e2 e4', or 'undo'"
     running = True
     game_over = False
     
@@ -161,14 +285,31 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                # The window manager threw away what was on screen
+                renderer.invalidate()
             
-            if board.turn == "white" and not game_over:
+            if not game_over:
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_BACKSPACE:
                         user_text = user_text[:-1]
                     elif event.key == pygame.K_RETURN:
                         coords = parse_move(user_text)
-                        if coords:
+                        if board.turn != "white":
+                            # The text is kept, so the move can be sent once Black has replied
+                            status_message = "Wait for Black's move."
+                        elif user_text.strip().lower() == "undo":
+                            # Takes back Black's reply and White's move
+                            if len(board.undo_stack) >= 2:
+                                # The engine was pondering replies to a move that is now gone
+                                ponder_future = stop_pondering(ponder_future, ponder_stop)
+                                board.unmake_move()
+                                board.unmake_move()
+                                status_message = "Move taken back. White to move."
+                            else:
+                                status_message = "Nothing to take back."
+                            user_text = ""
+                        elif coords:
                             cur_r, cur_c, next_r, next_c = coords
                             result = board.move_api(cur_r, cur_c, next_r, next_c)
                             if result == 0:
@@ -183,40 +324,62 @@ def main():
                         user_text += event.unicode
 
         if not game_over:
-            if board.is_checkmate():
+            # Cached by the board until a move is played, so this is cheap every frame
+            status = board.game_status()
+            if status == "checkmate":
                 game_over = True
                 winner = "Black" if board.turn == "white" else "White"
                 status_message = f"Checkmate! {winner} Won."
-            elif len(board.action_space()) == 0:
+            elif status == "stalemate":
                 game_over = True
                 status_message = "Stalemate."
-            elif board.current_turn >= board.max_turn:
+            elif status == "max_turn":
                 game_over = True
                 status_message = "Draw (Max turns)."
+            if game_over:
+                # Nothing left to ponder on once the game has ended
+                ponder_future = stop_pondering(ponder_future, ponder_stop)
 
         if board.turn == "black" and not game_over:
-            if current_time - last_move_time > ai_delay_ms:
+            if ai_future is None:
+                if current_time - last_move_time > ai_delay_ms:
+                    ponder_future = stop_pondering(ponder_future, ponder_stop)
+                    sync_engine(engine, board)
+                    ai_future = executor.submit(engine.move)
+                    status_message = "Black is thinking..."
+            elif ai_future.done():
+                future, ai_future = ai_future, None
                 try:
-                    ai_move = board.random_action()
+                    ai_move = future.result()
                     board.move_api(*ai_move)
                     
                     files = "abcdefgh"
                     r1, c1, r2, c2 = ai_move
                     move_str = f"{files[c1]}{r1+1}->{files[c2]}{r2+1}"
                     status_message = f"Black played {move_str}. Your turn."
+                    info = getattr(engine, "search_info", None)
+                    if info:
+                        status_message = (f"Black played {move_str} (depth {info['depth']}, "
+                                          f"{info['nps']:.0f} nodes/s). Your turn.")
+                    if PONDER and hasattr(engine, "ponder"):
+                        # The engine board already has its own move played, so it ponders White's replies
+                        ponder_stop.clear()
+                        ponder_future = executor.submit(engine.ponder, ponder_stop)
                 except Exception as e:
                     print(f"AI Error: {e}")
 
-        screen.fill(BG_COLOR)
-        draw_board_and_coordinates(screen, font)
-        draw_pieces(screen, board, images)
-        
         is_white_turn = (board.turn == "white" and not game_over)
-        draw_ui(screen, font, user_text, status_message, is_white_turn)
-        
-        pygame.display.flip()
+        dirty_rects = renderer.draw(board, user_text, status_message, is_white_turn)
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
         clock.tick(FPS)
 
+    # Stops a search still running so the thread can finish before the window goes
+    stop_event.set()
+    ponder_stop.set()
+    executor.shutdown(wait=True, cancel_futures=True)
+    if hasattr(engine, "close"):
+        engine.close()
     pygame.quit()
     sys.exit()
 
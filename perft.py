@@ -0,0 +1,105 @@
+"""
+Perft: counts the leaf nodes of the move tree to a fixed depth, the standard correctness check
+and speed benchmark for a move generator.
+
+There is no castling, en passant or underpromotion in this game, so counts only match the
+published chess numbers while none of those can happen (the start position up to depth 4).
+
+Example:
+    python perft.py --depth 4
+    python perft.py --depth 3 --fen "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1"
+    python perft.py --depth 5 --workers 4
+"""
+import argparse
+import importlib
+import multiprocessing
+import time
+
+import chess
+
+
+def perft(board, depth: int) -> int:
+    if depth == 0:
+        return 1
+    moves = board.action_space()
+    # The last ply only needs the number of moves
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.make_move(*move)
+        nodes += perft(board, depth - 1)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board, depth: int) -> dict:
+    """Leaf count under every root move"""
+    counts = {}
+    for move in board.action_space():
+        board.make_move(*move)
+        counts[move] = perft(board, depth - 1)
+        board.unmake_move()
+    return counts
+
+
+def load_backend(path: str):
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def divide_worker(task) -> tuple:
+    """Counts one root move in a pool worker. task is (backend path, compact position, move, depth)."""
+    backend, compact, move, depth = task
+    board = load_backend(backend)()
+    board.from_compact(compact)
+    board.make_move(*move)
+    return move, perft(board, depth - 1)
+
+
+def parallel_divide(board, depth: int, workers: int, backend: str = "chess:BoardHumanVHuman") -> dict:
+    """divide with the root moves split across a process pool"""
+    compact = board.to_compact()
+    tasks = [(backend, compact, move, depth) for move in board.action_space()]
+    with multiprocessing.Pool(processes=workers) as pool:
+        return dict(pool.imap_unordered(divide_worker, tasks))
+
+
+def run(depth: int, fen=None, workers: int = 0, backend: str = "chess:BoardHumanVHuman",
+        show_divide: bool = True) -> dict:
+    board = load_backend(backend)()
+    if fen:
+        board.from_fen(fen)
+
+    start = time.perf_counter()
+    if depth == 0:
+        counts = {}
+    elif workers:
+        counts = parallel_divide(board, depth, workers, backend)
+    else:
+        counts = divide(board, depth)
+    elapsed = time.perf_counter() - start
+    nodes = sum(counts.values()) if depth else 1
+
+    if show_divide:
+        for move in sorted(counts):
+            print(f"{chess.move_to_text(move)}: {counts[move]}")
+    nodes_per_second = nodes / elapsed if elapsed else 0.0
+    print(f"Depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes_per_second:.0f} nodes/s)")
+    return {"depth": depth, "nodes": nodes, "seconds": elapsed, "nodes_per_second": nodes_per_second,
+            "divide": {chess.move_to_text(move): count for move, count in counts.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft node counts for the move generator")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fen", default=None, help="Start position, the initial position by default")
+    parser.add_argument("--workers", type=int, default=0, help="Split the root moves across this many processes")
+    parser.add_argument("--backend", default="chess:BoardHumanVHuman", help="Board class as module:Class")
+    parser.add_argument("--no-divide", action="store_true", help="Only print the total")
+    args = parser.parse_args()
+    run(args.depth, args.fen, args.workers, args.backend, not args.no_divide)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Binary game-record shards. A shard is a 16-byte header followed by fixed-width records,
+one per position a move was played from:
+
+    32 bytes  piece codes (BoardHumanVHuman.piece_codes), two squares per byte, low nibble first
+     1 byte   side to move, 0 white and 1 black
+     2 bytes  ply (current_turn), little endian
+     2 bytes  move, from square | to square << 6, square = row * 8 + column
+
+Shards are only ever appended to, and ShardReader memory-maps them for random access by index.
+"""
+import bisect
+import mmap
+import os
+import struct
+
+MAGIC = b"CHSR"
+VERSION = 1
+HEADER = struct.Struct("<4sHH8x")
+RECORD = struct.Struct("<32sBHH")
+
+
+def pack_position(board) -> bytes:
+    """The 35 position bytes of a record (pieces, side to move, ply)"""
+    compact = board.to_compact()
+    pieces = bytes(compact[square] | (compact[square + 1] << 4) for square in range(0, 64, 2))
+    return pieces + compact[64:67]
+
+
+def encode_move(move) -> int:
+    current_row, current_column, next_row, next_column = move
+    return (current_row * 8 + current_column) | ((next_row * 8 + next_column) << 6)
+
+
+def decode_move(value: int) -> tuple:
+    start, end = value & 63, (value >> 6) & 63
+    return (start // 8, start % 8, end // 8, end % 8)
+
+
+def encode_record(board, move) -> bytes:
+    """Record for move played from the current position of board"""
+    return pack_position(board) + struct.pack("<H", encode_move(move))
+
+
+def unpack_position(pieces, turn: int, ply: int) -> bytes:
+    """Turns the packed pieces of a record back into a to_compact()/from_compact() string"""
+    codes = bytearray(64)
+    for index, byte in enumerate(pieces):
+        codes[2 * index] = byte & 15
+        codes[2 * index + 1] = byte >> 4
+    return bytes(codes) + bytes([turn]) + ply.to_bytes(2, "little")
+
+
+class ShardWriter():
+    def __init__(self, path: str):
+        """Opens path for appending, writing the header if the shard is new"""
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, "rb") as file:
+                _check_header(file.read(HEADER.size), path)
+        self.file = open(path, "ab")
+        if new_file:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def write(self, board, move) -> None:
+        self.file.write(encode_record(board, move))
+
+    def write_records(self, data: bytes) -> None:
+        """Appends records already encoded with encode_record"""
+        if len(data) % RECORD.size != 0:
+            raise ValueError(f"Record data must be a multiple of {RECORD.size} bytes")
+        self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _check_header(data: bytes, path: str) -> None:
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is too short to be a shard")
+    magic, version, record_size = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a version {VERSION} shard")
+
+
+class ShardReader():
+    def __init__(self, *paths: str):
+        """Memory-maps every shard, records are numbered across them in the order given"""
+        self.files = []
+        self.mmaps = []
+        self.maps = []
+        # starts[i] is the global index of the first record in shard i
+        self.starts = []
+        total = 0
+        for path in paths:
+            file = open(path, "rb")
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            _check_header(data[:HEADER.size], path)
+            self.files.append(file)
+            self.mmaps.append(data)
+            self.maps.append(memoryview(data))
+            self.starts.append(total)
+            total += (len(data) - HEADER.size) // RECORD.size
+        self.length = total
+
+    def __len__(self) -> int:
+        return self.length
+
+    def raw(self, index: int) -> memoryview:
+        """The record bytes at index, a view into the mapped file without copying"""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        shard = bisect.bisect_right(self.starts, index) - 1
+        offset = HEADER.size + (index - self.starts[shard]) * RECORD.size
+        return self.maps[shard][offset:offset + RECORD.size]
+
+    def __getitem__(self, index: int) -> tuple:
+        """(packed pieces view, side to move, ply, move tuple)"""
+        record = self.raw(index)
+        turn, ply, move = struct.unpack_from("<BHH", record, 32)
+        return (record[:32], turn, ply, decode_move(move))
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self[index]
+
+    def load_board(self, index: int, board) -> tuple:
+        """Sets board to the position of record index and returns the move played from it"""
+        pieces, turn, ply, move = self[index]
+        board.from_compact(unpack_position(pieces, turn, ply))
+        return move
+
+    def close(self) -> None:
+        """Unmaps the shards, views handed out by raw() must be released first"""
+        for view in self.maps:
+            view.release()
+        for data in self.mmaps:
+            data.close()
+        for file in self.files:
+            file.close()
+        self.maps = []
+        self.mmaps = []
+        self.files = []
@@ -0,0 +1,165 @@
+"""
+Headless batch self-play. Plays many games of a policy class across a process pool and
+writes every finished game to disk as soon as it is done. Does not import pygame.
+
+A policy class is a board class whose move() plays one move and returns it,
+like chess.RandomVRandom or chess.AIVMCTS.
+
+Games go to a JSON-lines file, or with --format shard every position and the move played
+from it go to a binary shard (see records.py).
+
+Example:
+    python selfplay.py --games 1000 --workers 4 --output games.jsonl
+    python selfplay.py --games 100000 --format shard --output games.shard
+    python selfplay.py --policy chess:AIVMCTS --policy-args '{"depth": 3, "width": 50}'
+    python selfplay.py --policy chess:AIVMCTS --policy-args '{"depth": 3, "width": 50}' --clock 60 --increment 1
+"""
+import argparse
+import importlib
+import inspect
+import json
+import multiprocessing
+import random
+import time
+
+import chess
+import records
+
+
+def load_policy(path: str):
+    """Turns 'module:Class' into the class"""
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def accepts_seed(policy_class) -> bool:
+    """Whether the policy constructor takes a seed of its own, like AIVMCTS"""
+    return "seed" in inspect.signature(policy_class).parameters
+
+
+def game_result(board):
+    """Returns (result, reason) once the game is over, otherwise None"""
+    status = board.game_status()
+    if status is None:
+        return None
+    if status == "checkmate":
+        return ("black" if board.turn == "white" else "white", "checkmate")
+    return ("draw", status)
+
+
+def play_game(task) -> dict:
+    """
+    Plays one whole game in a worker. task is (policy path, policy kwargs, game index, seed, binary, clock).
+    With binary the positions are returned as encoded shard records instead of a move list.
+    clock is None or (milliseconds per side, increment per move in milliseconds). Each side's thinking
+    time is taken off its clock, a side whose clock runs out loses, and policies with allocate_move_time
+    (AIVMCTS) get their time left passed to move(). Games with a clock depend on timing, so the seed
+    no longer replays them exactly.
+    """
+    policy_path, policy_args, index, seed, binary, clock = task
+    random.seed(seed)
+    policy_class = load_policy(policy_path)
+    # Policies with their own random generator get the game seed too, so the recorded seed replays the game
+    if accepts_seed(policy_class):
+        policy_args = {**policy_args, "seed": seed}
+    board = policy_class(**policy_args)
+    moves = []
+    encoded = bytearray()
+    # Milliseconds left for white and black
+    remaining = None if clock is None else [clock[0], clock[0]]
+    while True:
+        finished = game_result(board)
+        if finished is not None:
+            break
+        position = records.pack_position(board) if binary else None
+        side = 0 if board.turn == "white" else 1
+        start = time.perf_counter()
+        if remaining is not None and hasattr(board, "allocate_move_time"):
+            move = board.move(remaining_ms=remaining[side], increment_ms=clock[1])
+        else:
+            move = board.move()
+        if binary:
+            encoded += position + records.encode_move(move).to_bytes(2, "little")
+        else:
+            moves.append(chess.move_to_text(move))
+        if remaining is not None:
+            remaining[side] -= 1000 * (time.perf_counter() - start)
+            if remaining[side] < 0:
+                finished = ("black" if side == 0 else "white", "time")
+                break
+            remaining[side] += clock[1]
+    result, reason = finished
+    game = {"game": index, "seed": seed, "result": result, "reason": reason, "plies": board.current_turn}
+    if remaining is not None:
+        game["clock_ms"] = [round(left) for left in remaining]
+    if binary:
+        game["records"] = bytes(encoded)
+    else:
+        game["moves"] = moves
+    return game
+
+
+def run(games: int, workers: int, output: str, policy: str = "chess:RandomVRandom",
+        policy_args=None, seed: int = 0, report_every: int = 100, format: str = "jsonl", clock=None) -> dict:
+    """
+    Plays games and appends each finished game to output, one JSON line per game
+    or its shard records with format "shard". clock is None or (milliseconds per side,
+    increment in milliseconds), see play_game. Returns the totals.
+    """
+    policy_args = policy_args or {}
+    if policy_args.get("workers", 0) > 0:
+        # Pool workers are daemon processes, which may not start a process pool of their own
+        raise ValueError("policy workers > 0 can't run inside the self-play pool, use --workers to spread games instead")
+    binary = format == "shard"
+    tasks = ((policy, policy_args, index, seed + index, binary, clock) for index in range(games))
+    results = {"white": 0, "black": 0, "draw": 0}
+    plies = 0
+    finished = 0
+    start = time.perf_counter()
+
+    writer = records.ShardWriter(output) if binary else open(output, "a")
+    with writer, multiprocessing.Pool(processes=workers) as pool:
+        # One game per task, so a worker never holds more than the game it is playing
+        for record in pool.imap_unordered(play_game, tasks, chunksize=1):
+            if binary:
+                writer.write_records(record["records"])
+            else:
+                writer.write(json.dumps(record) + "\n")
+            writer.flush()
+            results[record["result"]] += 1
+            plies += record["plies"]
+            finished += 1
+            if report_every and finished % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{finished}/{games} games, {finished / elapsed:.2f} games/s, {plies / elapsed:.1f} plies/s")
+
+    elapsed = time.perf_counter() - start
+    totals = {"games": finished, "plies": plies, "seconds": elapsed,
+              "games_per_second": finished / elapsed if elapsed else 0.0,
+              "plies_per_second": plies / elapsed if elapsed else 0.0, **results}
+    print(f"Done: {finished} games, {plies} plies in {elapsed:.1f}s "
+          f"({totals['games_per_second']:.2f} games/s, {totals['plies_per_second']:.1f} plies/s), "
+          f"white {results['white']} black {results['black']} draw {results['draw']}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch self-play")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", default="games.jsonl")
+    parser.add_argument("--policy", default="chess:RandomVRandom", help="module:Class with a move() method")
+    parser.add_argument("--policy-args", default="{}", help="JSON keyword arguments for the policy class")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-every", type=int, default=100)
+    parser.add_argument("--format", choices=("jsonl", "shard"), default="jsonl")
+    parser.add_argument("--clock", type=float, default=None, help="Seconds on each side's clock for the whole game")
+    parser.add_argument("--increment", type=float, default=0.0, help="Seconds added to the clock after every move")
+    args = parser.parse_args()
+    clock = None if args.clock is None else (1000 * args.clock, 1000 * args.increment)
+    run(args.games, args.workers, args.output, args.policy, json.loads(args.policy_args),
+        args.seed, args.report_every, args.format, clock)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import sys
+
+# Rough size of one filled slot: the entry object, its ints and a packed move list of about 30 moves
+ENTRY_BYTES = 320
+
+REPLACEMENT_POLICIES = ("depth", "aging")
+
+
+class TTEntry():
+    __slots__ = ("key", "visits", "score", "moves", "depth", "age")
+
+    def __init__(self, key: int, depth: int, age: int):
+        self.key = key
+        self.visits = 0
+        self.score = 0
+        # Legal moves packed as two bytes (from square, to square) per move, None until stored
+        self.moves = None
+        self.depth = depth
+        self.age = age
+
+    def move_list(self) -> list:
+        return [(start // 8, start % 8, end // 8, end % 8)
+                for start, end in zip(self.moves[::2], self.moves[1::2])]
+
+
+class TranspositionTable():
+    def __init__(self, max_mb: float = 16, policy: str = "depth"):
+        """
+        Fixed number of slots indexed by position key, sized so the table stays under max_mb.
+        When two positions want the same slot the policy decides which one stays:
+        "depth" keeps the entry stored with the most search below it, "aging" also replaces
+        anything left over from an earlier search.
+        """
+        if policy not in REPLACEMENT_POLICIES:
+            raise ValueError(f"Unknown replacement policy {policy}, use one of {REPLACEMENT_POLICIES}")
+        self.policy = policy
+        self.max_mb = max_mb
+        self.size = max(1, int(max_mb * 1024 * 1024) // (ENTRY_BYTES + 8))
+        self.slots = [None] * self.size
+        self.generation = 0
+
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+        self.rejections = 0
+
+    def new_search(self) -> None:
+        """Called once per move so the aging policy can tell old entries from new ones"""
+        self.generation += 1
+
+    def probe(self, key: int):
+        self.probes += 1
+        entry = self.slots[key % self.size]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            entry.age = self.generation
+            return entry
+        return None
+
+    def store(self, key: int, depth: int):
+        """
+        Returns the entry for key, creating it if the slot can be taken.
+        Returns None when the replacement policy keeps the entry already in the slot.
+        """
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is not None and entry.key == key:
+            entry.depth = max(entry.depth, depth)
+            entry.age = self.generation
+            return entry
+
+        if entry is not None:
+            stale = self.policy == "aging" and entry.age < self.generation
+            if not stale and entry.depth > depth:
+                self.rejections += 1
+                return None
+            self.replacements += 1
+
+        self.stores += 1
+        entry = TTEntry(key, depth, self.generation)
+        self.slots[index] = entry
+        return entry
+
+    def store_moves(self, key: int, moves: list, depth: int = 0) -> None:
+        entry = self.store(key, depth)
+        if entry is not None:
+            entry.moves = bytes(square for move in moves
+                                for square in (move[0] * 8 + move[1], move[2] * 8 + move[3]))
+
+    def hit_rate(self) -> float:
+        if self.probes == 0:
+            return 0.0
+        return self.hits / self.probes
+
+    def memory_used_mb(self) -> float:
+        filled = sum(1 for entry in self.slots if entry is not None)
+        return (sys.getsizeof(self.slots) + filled * ENTRY_BYTES) / (1024 * 1024)
+
+    def stats(self) -> dict:
+        return {"size": self.size, "probes": self.probes, "hits": self.hits,
+                "hit_rate": self.hit_rate(), "stores": self.stores,
+                "replacements": self.replacements, "rejections": self.rejections,
+                "memory_mb": self.memory_used_mb()}
+
+    def clear(self) -> None:
+        self.slots = [None] * self.size
+        self.generation = 0